@@ -1,12 +1,74 @@
+import errno
 import os
+import threading
+from collections import OrderedDict
 from hashlib import sha1
 from pathlib import Path
 from tempfile import mkstemp
-from typing import Optional
+from typing import Callable, Dict, Optional, Protocol, Tuple
 
 import appdirs
 
 
+class _Hasher(Protocol):
+    @property
+    def name(self) -> str:
+        ...
+
+    def hexdigest(self) -> str:
+        ...
+
+
+_HashFactory = Callable[[bytes], _Hasher]
+
+try:
+    # Cache keys are short and the entries are local and immutable, so we don't
+    # need a cryptographic hash here -- just a cheap, well-distributed one.
+    from blake3 import blake3
+
+    _default_hash_factory: _HashFactory = blake3
+except ImportError:  # pragma: no cover
+    _default_hash_factory = sha1
+
+try:
+    # METADATA is text, and compresses several-fold.
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None  # type: ignore[assignment,unused-ignore]
+
+# Plain entries are METADATA-style text, which can't start with this.
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# Entries live under cache_path in a directory named for this and the hash, so
+# changing either starts a fresh one.  Anything else there is from an older
+# layout (or another hash) and can be removed.
+CACHE_LAYOUT_VERSION = 2
+
+MAX_MISSES = 10000
+MAX_MEMORY_ENTRIES = 512
+
+_PROC_SELF_FD: Optional[Tuple[int, int]] = None
+
+
+def _proc_self_fd() -> int:
+    """
+    Returns a (per-process, long-lived) directory fd for /proc/self/fd.
+    """
+    global _PROC_SELF_FD
+    pid = os.getpid()
+    if _PROC_SELF_FD is None or _PROC_SELF_FD[0] != pid:
+        _PROC_SELF_FD = (pid, os.open("/proc/self/fd", os.O_RDONLY | os.O_DIRECTORY))
+    return _PROC_SELF_FD[1]
+
+
+def _write_all(fd: int, value: bytes) -> None:
+    # Cache values are written once, in full, so skip the buffered file object;
+    # for typical sizes this is a single write(2).
+    view = memoryview(value)
+    while view:
+        view = view[os.write(fd, view) :]
+
+
 class SimpleCache:
     """
     An extremely simple cache for storing immutable objects.
@@ -21,35 +83,194 @@ class SimpleCache:
             cache_path = cache_path / suffix
 
         self.cache_path = cache_path
-        self.hash_factory = sha1
+        # The hot path works on plain strings; pathlib is comparatively heavy.
+        self._cache_path_str = str(cache_path)
+        self.hash_factory: _HashFactory = _default_hash_factory
         self.stats = {"hits": 0, "pass": 0, "sets": 0}
+        # The same key is typically probed with get() and then set(), so keep
+        # the derived path around rather than hashing again.
+        self._local_paths: Dict[str, str] = {}
+        # Keys known to be absent, so repeated misses don't hit the filesystem.
+        # This is bounded FIFO-style; set() removes the key.
+        self._misses: OrderedDict[str, None] = OrderedDict()
+        # Bumped by every set(), so get() can tell whether one ran while it
+        # was reading the disk (and not record a stale miss).
+        self._set_generation = 0
+        # Recently used values, LRU-style, so shared transitive deps don't
+        # re-read the same file.
+        self._memory: OrderedDict[str, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+        self._use_tmpfile = hasattr(os, "O_TMPFILE")
+        # Reads shouldn't dirty the inode by updating atime.
+        self._noatime: int = getattr(os, "O_NOATIME", 0)
+        self._read_flags = os.O_RDONLY | getattr(os, "O_BINARY", 0)
+        # Compressed and plain entries can be mixed; reads check for the magic.
+        self.compress = zstandard is not None
 
     def _local_path(self, key: str) -> Path:
-        h = self.hash_factory(key.encode("utf-8")).hexdigest()
-        return self.cache_path.joinpath(*h[:5], h)
+        return Path(self._local_str(key))
+
+    def _local_str(self, key: str) -> str:
+        if (p := self._local_paths.get(key)) is None:
+            # Thanks to the memo this encode happens once per key; for the
+            # (ASCII) urls we use as keys, CPython's utf-8 encode is a memcpy.
+            hasher = self.hash_factory(key.encode("utf-8"))
+            h = hasher.hexdigest()
+            # 256 shards is plenty to keep directories small.
+            p = self._local_paths[key] = os.path.join(
+                self._cache_path_str,
+                f"v{CACHE_LAYOUT_VERSION}-{hasher.name}",
+                h[:2],
+                h,
+            )
+        return p
 
     def get(self, key: str) -> Optional[bytes]:
-        p = self._local_path(key)
+        with self._lock:
+            if (data := self._memory.get(key)) is not None:
+                self._memory.move_to_end(key)
+                self.stats["hits"] += 1
+                return data
+            if key in self._misses:
+                self.stats["pass"] += 1
+                return None
+            generation = self._set_generation
+        p = self._local_str(key)
         try:
-            data = p.read_bytes()
+            data = self._decode(self._read(p))
+        except OSError:
+            data = None
+        if data is None:
+            with self._lock:
+                self.stats["pass"] += 1
+                if self._set_generation == generation:
+                    self._misses[key] = None
+                    if len(self._misses) > MAX_MISSES:
+                        self._misses.popitem(last=False)
+            return None
+        with self._lock:
             self.stats["hits"] += 1
+            self._remember(key, data)
+        return data
+
+    def _read(self, p: str) -> bytes:
+        try:
+            fd = os.open(p, self._read_flags | self._noatime)
+        except PermissionError:
+            # O_NOATIME is only allowed on files we own
+            if not self._noatime:
+                raise
+            self._noatime = 0
+            fd = os.open(p, self._read_flags)
+        try:
+            size = os.fstat(fd).st_size
+            data = os.read(fd, size)
+            # Regular files basically never return short reads, but be safe.
+            while len(data) < size and (more := os.read(fd, size - len(data))):
+                data += more
+        finally:
+            os.close(fd)
+        return data
+
+    def _decode(self, data: bytes) -> Optional[bytes]:
+        """
+        Returns None for an entry that can't be read here (compressed, but
+        zstandard isn't installed; or corrupt), so it's treated as a miss.
+        """
+        if data[:4] != ZSTD_MAGIC:
             return data
-        except OSError:
-            self.stats["pass"] += 1
+        if zstandard is None:
+            return None
+        try:
+            return zstandard.ZstdDecompressor().decompress(data)  # type: ignore[no-any-return,unused-ignore]
+        except zstandard.ZstdError:
             return None
 
+    def _remember(self, key: str, value: bytes) -> None:
+        # Must hold self._lock
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        if len(self._memory) > MAX_MEMORY_ENTRIES:
+            self._memory.popitem(last=False)
+
     def set(self, key: str, value: bytes) -> None:
-        p = self._local_path(key)
-        p.parent.mkdir(parents=True, exist_ok=True)
-        (fd, temp_name) = mkstemp(f".{os.getpid()}", prefix=p.name, dir=p.parent)
-        with os.fdopen(fd, "wb") as f:
-            f.write(value)
+        p = self._local_str(key)
+        stored = value
+        if self.compress:
+            # Compressors aren't safe to share between threads
+            stored = zstandard.ZstdCompressor(level=3).compress(value)
+        if not (self._use_tmpfile and self._set_tmpfile(p, stored)):
+            self._set_mkstemp(p, stored)
+        with self._lock:
+            self._set_generation += 1
+            self._misses.pop(key, None)
+            self._remember(key, value)
+            self.stats["sets"] += 1
+
+    def _set_tmpfile(self, p: str, value: bytes) -> bool:
+        """
+        Linux-only: write to an anonymous inode and link it into place, which
+        is atomic without needing a temp name or a rename.  Returns False if
+        the caller should fall back to _set_mkstemp.
+        """
+        parent = os.path.dirname(p)
+        try:
+            try:
+                fd = os.open(parent, os.O_TMPFILE | os.O_WRONLY, 0o600)
+            except FileNotFoundError:
+                # Only the first write to each shard needs to create it.
+                os.makedirs(parent, exist_ok=True)
+                fd = os.open(parent, os.O_TMPFILE | os.O_WRONLY, 0o600)
+        except OSError as e:
+            if e.errno in (errno.EOPNOTSUPP, errno.EISDIR, errno.EINVAL):
+                # Kernel or filesystem doesn't support O_TMPFILE
+                self._use_tmpfile = False
+                return False
+            raise
+
+        try:
+            _write_all(fd, value)
+            # os.link only uses linkat(AT_SYMLINK_FOLLOW) when given a dir_fd,
+            # which is what we need to materialize the inode.
+            os.link(str(fd), p, src_dir_fd=_proc_self_fd())
+        except FileExistsError:
+            # linkat won't replace; let the rename path do that.
+            return False
+        except FileNotFoundError:
+            # No /proc
+            self._use_tmpfile = False
+            return False
+        finally:
+            os.close(fd)
+        return True
+
+    def _set_mkstemp(self, p: str, value: bytes) -> None:
+        parent, name = os.path.split(p)
+        try:
+            (fd, temp_name) = mkstemp(f".{os.getpid()}", prefix=name, dir=parent)
+        except FileNotFoundError:
+            # Only the first write to each shard needs to create it.
+            os.makedirs(parent, exist_ok=True)
+            (fd, temp_name) = mkstemp(f".{os.getpid()}", prefix=name, dir=parent)
+        try:
+            _write_all(fd, value)
+        finally:
+            os.close(fd)
 
         os.replace(temp_name, p)
-        self.stats["sets"] += 1
 
 
 class NoCache(SimpleCache):
+    """
+    Used for --no-cache.  Never reads or writes, so it skips all of
+    SimpleCache's setup (including the appdirs lookup).
+    """
+
+    def __init__(
+        self, cache_path: Optional[Path] = None, suffix: Optional[str] = None
+    ) -> None:
+        self.stats = {"hits": 0, "pass": 0, "sets": 0}
+
     def get(self, key: str) -> Optional[bytes]:
         return None
 
@@ -3,7 +3,7 @@ import os
 import threading
 import time
 from pathlib import Path
-from typing import Dict, IO, List, Optional
+from typing import Dict, IO, List, Optional, Tuple
 
 import click
 import keke
@@ -11,35 +11,41 @@ import keke
 from indexurl import get_index_url
 from indexurl.core import DEFAULT_INDEX_URL
 from packaging.requirements import Requirement
-from packaging.utils import canonicalize_name
 from pypi_simple import ACCEPT_JSON_PREFERRED, PyPISimple
 from vmodule import vmodule_init
 
 from .cache import NoCache, SimpleCache
 from .checkout import read_checkout_reqs
 from .markers import EnvironmentMarkers
+from .requirements import _iter_simple_requirements
 from .resolution import Walker
-from .session import get_cached_retry_session, get_retry_session
-from .types import CanonicalName
+from .session import DEFAULT_POOL_MAXSIZE, get_cached_retry_session, get_retry_session
+from .types import canonical_name, CanonicalName
 
 LOG = logging.getLogger(__name__)
 
+# Like vmodule's default, but with milliseconds since startup rather than
+# asctime, which costs a localtime+strftime for every record.
+LOG_FORMAT = "%(relativeCreated)d %(levelname)-8s %(name)s:%(lineno)s %(message)s"
 
-def _stats_thread() -> None:
-    prev_ts = None
-    prev_process_time = None
+
+def _stats_thread(interval: float = 0.25) -> None:
+    prev_ts = time.monotonic()
+    prev_process_time = time.process_time()
+    prev_pct: Optional[int] = None
     while True:
-        ts = time.time()
+        time.sleep(interval)
+        ts = time.monotonic()
         process_time = time.process_time()
-        if prev_ts is not None:
-            keke.kcount(
-                "proc_cpu_pct",
-                100 * (process_time - prev_process_time) / (ts - prev_ts),
-            )
+        pct = round(100 * (process_time - prev_process_time) / (ts - prev_ts))
+        # Counters hold their value until the next sample, so only emit changes
+        # (this keeps mostly-idle network waits from flooding the trace).
+        if pct != prev_pct:
+            keke.kcount("proc_cpu_pct", pct)
+            prev_pct = pct
 
         prev_ts = ts
         prev_process_time = process_time
-        time.sleep(0.1)
 
 
 @click.command()
@@ -131,17 +137,20 @@ def main(
 ) -> None:
     if trace:
         ctx.with_resource(keke.TraceOutput(trace))
-    vmodule_init(verbose, vmodule)
-    if stats:
+    vmodule_init(verbose, vmodule, format=LOG_FORMAT)
+    # Stats only go to the trace, so don't bother sampling without one.
+    if stats and trace:
         threading.Thread(target=_stats_thread, daemon=True).start()
 
-    uncached_session = get_retry_session()
+    # Each worker thread can hold a connection from both sessions at once.
+    pool_maxsize = max(DEFAULT_POOL_MAXSIZE, parallelism * 2)
+    uncached_session = get_retry_session(pool_maxsize)
     extracted_metadata_cache: SimpleCache
     if no_cache:
         cached_session = uncached_session
         extracted_metadata_cache = NoCache()
     else:
-        cached_session = get_cached_retry_session()
+        cached_session = get_cached_retry_session(pool_maxsize=pool_maxsize)
         extracted_metadata_cache = SimpleCache()
 
     if isolate_env:
@@ -159,7 +168,7 @@ def main(
         k, op, v = h.partition("==")
         if op != "==":
             raise click.ClickException(f"Invalid format for --have: {h!r}")
-        have_versions[CanonicalName(canonicalize_name(k))] = v
+        have_versions[canonical_name(k)] = v
 
     walker = Walker(
         parallelism,
@@ -175,15 +184,21 @@ def main(
         color=ctx.color,
     )
 
+    # Parse all inputs once up front; solve() runs again for every pin attempt
+    # below and shouldn't have to re-read checkouts and requirements files.
+    inputs: List[Tuple[List[Requirement], str]] = []
+    for dep in deps:
+        if dep.startswith(".") or "/" in dep:
+            source, checkout_deps = read_checkout_reqs(Path(dep))
+            inputs.append((checkout_deps, source))
+        else:
+            inputs.append(([Requirement(dep)], "arg"))
+    for req_file in requirements_file:
+        inputs.append((list(_iter_simple_requirements(Path(req_file))), req_file))
+
     def solve() -> None:
-        for dep in deps:
-            if dep.startswith(".") or "/" in dep:
-                source, checkout_deps = read_checkout_reqs(Path(dep))
-                walker.feed_from(checkout_deps, source)
-            else:
-                walker.feed(Requirement(dep))
-        for req in requirements_file:
-            walker.feed_file(Path(req))
+        for reqs, source in inputs:
+            walker.feed_from(reqs, source)
         walker.drain()
 
     solve()
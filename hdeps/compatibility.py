@@ -1,16 +1,18 @@
 import functools
 import logging
-from typing import Dict, List, Optional, Tuple
+import operator
+import re
+from bisect import bisect_left, bisect_right
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 
 from keke import kev
 
 from packaging.requirements import Requirement
 from packaging.specifiers import InvalidSpecifier, SpecifierSet
-from packaging.version import Version
+from packaging.version import InvalidVersion, Version
 from vmodule import VLOG_1, VLOG_2
 
-from .markers import EnvironmentMarkers
-from .projects import Project
+from .projects import parse_version, Project
 from .types import VersionCallback
 
 LOG = logging.getLogger(__name__)
@@ -20,57 +22,274 @@ class NoMatchingRelease(Exception):
     pass
 
 
+@functools.lru_cache(maxsize=1024)
+def _parse_requires_python(requires_python: str) -> Optional[SpecifierSet]:
+    """
+    Returns None for an invalid specifier.  There are only a handful of
+    distinct requires_python strings in the wild, so this is shared across all
+    projects.
+    """
+    try:
+        return SpecifierSet(requires_python)
+    except InvalidSpecifier:
+        return None
+
+
+# Most requires_python values are a single clause like ">=3.8".  For a plain
+# release (which the target python basically always is) these reduce to tuple
+# comparisons, with no need for packaging's parser.
+_SIMPLE_REQUIRES_PYTHON_RE = re.compile(r"^\s*(>=|<=|>|<|==|!=)\s*(\d+(?:\.\d+)*)\s*$")
+_SIMPLE_OPERATORS: Dict[str, Callable[[Tuple[int, ...], Tuple[int, ...]], bool]] = {
+    ">=": operator.ge,
+    "<=": operator.le,
+    ">": operator.gt,
+    "<": operator.lt,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+
+@functools.lru_cache(maxsize=1024)
+def _parse_simple_requires_python(
+    requires_python: str,
+) -> Optional[Tuple[str, Tuple[int, ...]]]:
+    if match := _SIMPLE_REQUIRES_PYTHON_RE.match(requires_python):
+        return match.group(1), tuple(int(x) for x in match.group(2).split("."))
+    return None
+
+
+def _is_plain_release(v: Version) -> bool:
+    return (
+        v.epoch == 0
+        and v.pre is None
+        and v.post is None
+        and v.dev is None
+        and v.local is None
+    )
+
+
+def _padded(release: Tuple[int, ...], length: int) -> Tuple[int, ...]:
+    # PEP 440 compares release segments as if zero-padded to equal length
+    return release + (0,) * (length - len(release))
+
+
+@functools.lru_cache(maxsize=4096)
+def _requires_python_ok(requires_python: str, python_version: Version) -> bool:
+    """
+    Memoizes the verdict as well as the parse; python_version is fixed for a
+    run, so this is effectively keyed on the string.
+    """
+    if (simple := _parse_simple_requires_python(requires_python)) is not None and (
+        _is_plain_release(python_version)
+    ):
+        op, release = simple
+        return _SIMPLE_OPERATORS[op](
+            _padded(python_version.release, len(release)),
+            _padded(release, len(python_version.release)),
+        )
+    if (specifier_set := _parse_requires_python(requires_python)) is None:
+        LOG.debug(
+            "Ignore invalid requires_python %r, including anyway", requires_python
+        )
+        return True
+    return python_version in specifier_set
+
+
 def requires_python_match(
-    project: Project, cache: Dict[str, bool], python_version: Version, v: Version
+    project: Project, python_version: Version, v: Version
 ) -> bool:
     pv = project.versions[v]
-    if not pv.requires_python:
+    # ProjectVersion normalizes "" to None
+    if pv.requires_python is None:
         return True
-    if (verdict := cache.get(pv.requires_python)) is not None:
-        return verdict
-    try:
-        specifier_set = SpecifierSet(pv.requires_python)
-        verdict = python_version in specifier_set
-    except InvalidSpecifier as e:
-        LOG.debug(
-            "Ignore %s==%s has invalid requires_python %r but including anyway",
-            project.name,
-            v,
-            e,
-        )
-        verdict = True
-    cache[pv.requires_python] = verdict
-    return verdict
+    return _requires_python_ok(pv.requires_python, python_version)
+
+
+@functools.lru_cache(maxsize=1024)
+def _specifier_bounds(
+    specifier: SpecifierSet,
+) -> Tuple[Optional[Version], bool, Optional[Version]]:
+    """
+    Returns (lower, lower_inclusive, upper_exclusive) such that every version
+    matching `specifier` is within those bounds.  This is intentionally
+    conservative -- operators that are awkward to bound (<=, !=, ===, and
+    wildcards, all of which interact with local versions or prereleases) are
+    just ignored.
+    """
+    lower: Optional[Version] = None
+    lower_inclusive = True
+    upper: Optional[Version] = None
+    for spec in specifier:
+        if spec.operator == "===" or spec.version.endswith(".*"):
+            continue
+        try:
+            v = Version(spec.version)
+        except InvalidVersion:
+            continue
+        if spec.operator in (">=", "~=", "=="):
+            if lower is None or v > lower:
+                lower, lower_inclusive = v, True
+        elif spec.operator == ">":
+            if lower is None or v >= lower:
+                lower, lower_inclusive = v, False
+        elif spec.operator == "<":
+            if upper is None or v < upper:
+                upper = v
+    return lower, lower_inclusive, upper
+
+
+def _public(v: Version) -> Version:
+    # Only reparse when there's actually a local segment to drop
+    return v if v.local is None else Version(v.public)
+
+
+def _same(v: Version) -> Version:
+    return v
+
+
+_CLAUSE_OPERATORS: Dict[str, Callable[[Version, Version], bool]] = {
+    ">=": operator.ge,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+
+def _clause(
+    op: Callable[[Version, Version], bool],
+    sv: Version,
+    strip: Callable[[Version], Version],
+) -> Callable[[Version], bool]:
+    def match(v: Version) -> bool:
+        return op(strip(v), sv)
+
+    return match
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile_specifier(
+    specifier: SpecifierSet,
+) -> Optional[Callable[[Version], bool]]:
+    """
+    Returns a function equivalent to `specifier.contains(v, prereleases=True)`,
+    with the specifier versions parsed once here rather than on every call.
+    Only the operators that are plain comparisons are handled (>=, <=, and
+    non-wildcard == and !=); for anything else this returns None.
+    """
+    clauses: List[Callable[[Version], bool]] = []
+    for spec in specifier:
+        if spec.operator not in _CLAUSE_OPERATORS or spec.version.endswith(".*"):
+            return None
+        try:
+            sv = Version(spec.version)
+        except InvalidVersion:
+            return None
+        # The candidate's local segment is ignored, except by == and != when the
+        # specifier has one
+        if spec.operator in ("==", "!=") and sv.local is not None:
+            strip = _same
+        else:
+            strip = _public
+        clauses.append(_clause(_CLAUSE_OPERATORS[spec.operator], sv, strip))
+
+    def matcher(v: Version) -> bool:
+        return all(clause(v) for clause in clauses)
+
+    return matcher
+
+
+def _specifier_contains(specifier: SpecifierSet, v: Version) -> bool:
+    """
+    `specifier.contains(v, prereleases=True)`, using the compiled form when
+    there is one.
+    """
+    if (matcher := _compile_specifier(specifier)) is not None:
+        return matcher(v)
+    return specifier.contains(v, prereleases=True)
+
+
+def _candidate_window(
+    sorted_versions: Sequence[Version], specifier: SpecifierSet
+) -> Sequence[Version]:
+    """
+    Returns the slice of (ascending) `sorted_versions` that might match.
+    """
+    lower, lower_inclusive, upper = _specifier_bounds(specifier)
+    lo = 0
+    hi = len(sorted_versions)
+    if lower is not None:
+        if lower_inclusive:
+            lo = bisect_left(sorted_versions, lower)
+        else:
+            lo = bisect_right(sorted_versions, lower)
+    if upper is not None:
+        hi = bisect_left(sorted_versions, upper)
+    return sorted_versions[lo:hi]
+
+
+def _iter_unconstrained(sorted_versions: Sequence[Version]) -> Iterator[Version]:
+    """
+    Equivalent to SpecifierSet("").filter(reversed(sorted_versions)), but lazy.
+    (For an empty SpecifierSet, filter builds the full list up front, and we
+    typically only want the first item.)
+    """
+    prereleases: List[Version] = []
+    found_final = False
+    for v in reversed(sorted_versions):
+        if v.is_prerelease:
+            # Only used if there are no final releases at all
+            if not found_final:
+                prereleases.append(v)
+        else:
+            found_final = True
+            yield v
+    if not found_final:
+        yield from prereleases
 
 
 def find_best_compatible_version(
     project: Project,
     req: Requirement,
-    env_markers: EnvironmentMarkers,
+    python_version: Version,
     already_chosen: Optional[Version],
     current_version_callback: VersionCallback,
 ) -> Version:
+    # An already-chosen version always wins if it survives the specifier filter
+    # below, so check for that up front.  Prereleases are only certain to
+    # survive if the specifier explicitly allows them (otherwise it depends on
+    # what else matches), so those take the long way.
+    if (
+        already_chosen is not None
+        and (not already_chosen.is_prerelease or req.specifier.prereleases)
+        and _specifier_contains(req.specifier, already_chosen)
+    ):
+        LOG.log(VLOG_1, "Reuse %s for %s", already_chosen, req)
+        return already_chosen
+
     # Handle requires_python first, so we can produce a better error message
     # when there are no version-compatible candidates (before we even get to
     # req.specifier)
-    python_version_str = env_markers.python_full_version
-    assert python_version_str is not None
-    python_version = Version(python_version_str)
-
     _requires_python_match = functools.partial(
-        requires_python_match, project, {}, python_version
+        requires_python_match, project, python_version
     )
 
     possible: List[Version] = []
 
     specifier_matched = False
-    with kev("reverse"):
-        rev = reversed(project.versions.keys())
+    # The newest version that passes both the specifier and requires_python
+    newest: Optional[Version] = None
+    filtered: Iterable[Version]
+    if len(req.specifier) == 0:
+        filtered = _iter_unconstrained(project.sorted_versions)
+    else:
+        window = _candidate_window(project.sorted_versions, req.specifier)
+        filtered = req.specifier.filter(reversed(window))
     with kev("initial filter"):
-        for version in req.specifier.filter(rev):
+        for version in filtered:
             specifier_matched = True
             if _requires_python_match(version):
                 # Only keep the first one
+                newest = version
                 possible.append(version)
                 break
 
@@ -80,7 +299,7 @@ def find_best_compatible_version(
         cur = current_version_callback(project.name)
     cur_v: Optional[Version] = None
     if cur:
-        cur_v = Version(cur)
+        cur_v = parse_version(cur)
         # Allow the current version to be a guess -- it doesn't actually have to
         # be compatible with the current version of python.  Filter out if we
         # know for sure.
@@ -108,9 +327,13 @@ def find_best_compatible_version(
     # The documentation for SepcifierSet.filter notes that it handles the logic
     # for whether to include prereleases, so we don't need that here.
     LOG.log(VLOG_1, "possible for %s: %s", req, possible)
-    with kev("filter by specifier"):
-        # This should only ever be ~3 items now!
-        possible = list(req.specifier.filter(possible))
+    # Filtering is only needed when the current or already-chosen version added
+    # something beyond `newest`.  It has to be done on the whole list, because
+    # whether prereleases are allowed depends on what else matches.
+    if any(p != newest for p in possible):
+        with kev("filter by specifier"):
+            # This should only ever be ~3 items now!
+            possible = list(req.specifier.filter(possible))
     if not possible:
         if not list(req.specifier.filter(project.versions.keys())):
             # Referencing the dragon above, if we had a current version and it was
@@ -126,19 +349,16 @@ def find_best_compatible_version(
 
     # TODO: yanked support
 
-    # The sort key is
-    # ( matches_already_chosen: bool,
-    #   matches_current_version: bool,
-    #   recency_index: int,
-    #   version: Version )
-    # so that after sorting the last item is the "best" one.
-
-    with kev("final sort"):
-        xform_possible: List[Tuple[bool, bool, int, Version]] = sorted(
-            (p == already_chosen, p == cur_v, i, p) for (i, p) in enumerate(possible)
-        )
+    # In order of preference: already chosen, the current version, then
+    # whatever is left (which can only be the newest match).  When a value
+    # appears more than once, the later entry is the same object as
+    # already_chosen/cur_v, so return that one.
+    if already_chosen is not None and already_chosen in possible:
+        best = already_chosen
+    elif cur_v is not None and cur_v in possible:
+        best = cur_v
+    else:
+        best = possible[-1]
 
-    LOG.log(VLOG_1, "Sorted %s", project.name)
-    for el in xform_possible:
-        LOG.log(VLOG_1, "%s", el)
-    return xform_possible[-1][3]
+    LOG.log(VLOG_1, "Best for %s: %s", project.name, best)
+    return best
@@ -0,0 +1,99 @@
+import heapq
+import itertools
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, TypeVar
+
+T = TypeVar("T")
+
+# Lower runs first.
+DEFAULT_PRIORITY = 0
+PREFETCH_PRIORITY = 10
+BUMP_PRIORITY = -1
+
+# Shutdown sentinels (None) go after any queued work, as with the stock FIFO.
+_SENTINEL_PRIORITY = float("inf")
+_REMOVED = object()
+
+
+class _PriorityWorkQueue(queue.Queue[Any]):
+    """
+    Stands in for ThreadPoolExecutor's work queue, handing out the lowest
+    priority first (FIFO within a priority).  Only the documented Queue
+    subclass hooks are overridden, so locking is Queue's.
+    """
+
+    def _init(self, maxsize: int) -> None:
+        # Entries are [priority, seq, item]; bumped entries are left in place
+        # with item=_REMOVED rather than re-heapifying.
+        self._heap: List[List[Any]] = []
+        self._live = 0
+        self._seq = itertools.count()
+        self._entries: Dict["Future[Any]", List[Any]] = {}
+        # submit() calls put() synchronously, so the priority for the item
+        # being submitted is passed along per-thread.
+        self._submitting = threading.local()
+
+    def _qsize(self) -> int:
+        return self._live
+
+    def _put(self, item: Any) -> None:
+        if item is None:
+            priority: float = _SENTINEL_PRIORITY
+        else:
+            priority = getattr(self._submitting, "priority", DEFAULT_PRIORITY)
+        entry = [priority, next(self._seq), item]
+        if item is not None:
+            self._entries[item.future] = entry
+        heapq.heappush(self._heap, entry)
+        self._live += 1
+
+    def _get(self) -> Any:
+        while True:
+            _, _, item = heapq.heappop(self._heap)
+            if item is not _REMOVED:
+                break
+        if item is not None:
+            del self._entries[item.future]
+        self._live -= 1
+        return item
+
+    def bump(self, fut: "Future[Any]", priority: int) -> None:
+        with self.mutex:
+            entry = self._entries.get(fut)
+            if entry is None or entry[0] <= priority:
+                # Already running (or done), or already at least this urgent
+                return
+            new_entry = [priority, next(self._seq), entry[2]]
+            entry[2] = _REMOVED
+            self._entries[fut] = new_entry
+            heapq.heappush(self._heap, new_entry)
+
+
+class PriorityThreadPoolExecutor(ThreadPoolExecutor):
+    """
+    A ThreadPoolExecutor where queued work can be prioritized, so that what
+    the caller is about to block on doesn't wait behind speculative prefetches.
+    """
+
+    def __init__(self, max_workers: int) -> None:
+        super().__init__(max_workers=max_workers)
+        # Workers are started lazily by submit(), so they pick this up.
+        self._prio_queue = _PriorityWorkQueue()
+        self._work_queue = self._prio_queue  # type: ignore[assignment]
+
+    def submit_with_priority(
+        self, priority: int, fn: Callable[..., T], /, *args: Any, **kwargs: Any
+    ) -> "Future[T]":
+        self._prio_queue._submitting.priority = priority
+        try:
+            return self.submit(fn, *args, **kwargs)
+        finally:
+            self._prio_queue._submitting.priority = DEFAULT_PRIORITY
+
+    def bump(self, fut: "Future[Any]", priority: int = BUMP_PRIORITY) -> None:
+        """
+        Moves `fut` ahead of other queued work, if it hasn't started yet.
+        """
+        self._prio_queue.bump(fut, priority)
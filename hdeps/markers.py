@@ -1,8 +1,17 @@
 import sys
-from dataclasses import asdict, dataclass, replace
-from typing import Optional, Sequence
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from functools import cached_property
+from typing import Any, Dict, Optional, Sequence, Tuple
 
 from packaging.markers import Marker
+from packaging.version import Version
+
+MAX_MATCH_CACHE_ENTRIES = 4096
+
+# Held only for the (quick) cache bookkeeping, never while evaluating.
+_MATCH_CACHE_LOCK = threading.Lock()
 
 
 @dataclass
@@ -30,16 +39,69 @@ class EnvironmentMarkers:
         else:
             raise TypeError(f"Unknown sys_platform: {self.sys_platform!r}")
 
+    # These are computed on first use; don't modify fields after that.
+
+    @cached_property
+    def _env(self) -> Dict[str, Any]:
+        # Not asdict(), which deep-copies every value; these are all str/None.
+        return {
+            "os_name": self.os_name,
+            "sys_platform": self.sys_platform,
+            "platform_machine": self.platform_machine,
+            "platform_python_implementation": self.platform_python_implementation,
+            "platform_release": self.platform_release,
+            "platform_system": self.platform_system,
+            "platform_version": self.platform_version,
+            "python_version": self.python_version,
+            "python_full_version": self.python_full_version,
+            "implementation_name": self.implementation_name,
+        }
+
+    @cached_property
+    def parsed_python_full_version(self) -> Optional[Version]:
+        if self.python_full_version is None:
+            return None
+        return Version(self.python_full_version)
+
+    @cached_property
+    def _match_cache(
+        self,
+    ) -> OrderedDict[Tuple[int, Tuple[str, ...]], Tuple[Marker, bool]]:
+        # Keyed on id() because hashing a Marker re-serializes it; the marker is
+        # kept in the value so that id can't be reused.  Requirements (and so
+        # their markers) are mostly shared via parse_requirement, and the same
+        # few markers show up over and over.  LRU-style, so markers from
+        # requirements we're done with don't stay alive for the whole walk.
+        return OrderedDict()
+
     def match(self, marker: Optional[Marker], extras: Sequence[str] = ()) -> bool:
-        env = asdict(self)
-        if marker:
-            if extras:
-                if not any(marker.evaluate(dict(env, extra=e)) for e in extras):
-                    return False
-            else:
-                if not marker.evaluate(env):
-                    return False
-        return True
+        if not marker:
+            return True
+        key = (id(marker), tuple(extras))
+        cache = self._match_cache
+        with _MATCH_CACHE_LOCK:
+            if (hit := cache.get(key)) is not None:
+                cache.move_to_end(key)
+                return hit[1]
+        # Races just evaluate twice
+        result = self._evaluate(marker, extras)
+        with _MATCH_CACHE_LOCK:
+            cache[key] = (marker, result)
+            if len(cache) > MAX_MATCH_CACHE_ENTRIES:
+                cache.popitem(last=False)
+        return result
+
+    def _evaluate(self, marker: Marker, extras: Sequence[str]) -> bool:
+        if not extras:
+            return marker.evaluate(self._env)
+        # One copy per call (the cached env is shared between threads), reused
+        # for each extra.
+        env_with_extra = dict(self._env)
+        for e in extras:
+            env_with_extra["extra"] = e
+            if marker.evaluate(env_with_extra):
+                return True
+        return False
 
     @classmethod
     def from_args(
@@ -1,16 +1,21 @@
 from __future__ import annotations
 
+import hashlib
+import io
+import json
 import logging
+import re
 import sys
-import tempfile
+import threading
 
 from collections import defaultdict
 from dataclasses import dataclass, field
-from email import message_from_string
-from functools import partial
-from pathlib import Path
-from tarfile import TarFile
-from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple, TypeVar, Union
+from functools import lru_cache, partial
+from operator import itemgetter
+from tarfile import TarFile, TarInfo
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+from urllib.parse import urlsplit
+from weakref import WeakValueDictionary
 from zipfile import ZipFile
 
 import metadata_please
@@ -18,36 +23,50 @@ from indexurl import get_index_url
 
 from keke import kev
 from packaging.requirements import InvalidRequirement, Requirement
-from packaging.utils import canonicalize_name
 from packaging.version import InvalidVersion, Version
-from pypi_simple import DistributionPackage, ProjectPage, PyPISimple
-
+from pypi_simple import (
+    DigestMismatchError,
+    DistributionPackage,
+    ProjectPage,
+    PyPISimple,
+)
+
+from requests.exceptions import RequestException
 from requests.sessions import Session
 
 from seekablehttpfile import SeekableHttpFile
 from seekablehttpfile.core import get_range_requests
 
 from .cache import SimpleCache
-from .types import CanonicalName
-
-LOG = logging.getLogger(__name__)
+from .types import canonical_name, CanonicalName
 
-T = TypeVar("T")
-D = TypeVar("D")
+_json_loads: Callable[[bytes], Any]
+try:
+    import orjson
 
+    _json_loads = orjson.loads
+except ImportError:  # pragma: no cover
+    _json_loads = json.loads
 
-def first(it: Iterable[T], default: D) -> Union[T, D]:
-    """like any(...) but returns the first truthy value"""
-    for x in it:
-        if x:
-            return x
-    return default
+LOG = logging.getLogger(__name__)
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Project:
     name: CanonicalName
     versions: Dict[Version, ProjectVersion]
+    # Ascending, so compatibility checks can bisect rather than walking every
+    # version.  Derived from `versions`.
+    sorted_versions: Tuple[Version, ...] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        object.__setattr__(self, "sorted_versions", tuple(sorted(self.versions)))
+
+    @property
+    def latest_version(self) -> Optional[ProjectVersion]:
+        if not self.sorted_versions:
+            return None
+        return self.versions[self.sorted_versions[-1]]
 
     @classmethod
     def from_pypi_simple_project_page(cls, project_page: ProjectPage) -> Project:
@@ -57,63 +76,131 @@ class Project:
                 LOG.debug("Ignore unset version in %s", dp.filename)
                 continue
             try:
-                vers[Version(dp.version)].append(dp)
+                vers[parse_version(dp.version)].append(dp)
             except InvalidVersion:
                 LOG.debug("Ignore invalid version %s in %s", dp.version, dp.filename)
+        name = canonical_name(project_page.project)
         return cls(
-            name=CanonicalName(canonicalize_name(project_page.project)),
+            name=name,
             versions={
-                v: ProjectVersion(v, tuple(pkgs)) for v, pkgs in sorted(vers.items())
+                v: _intern_project_version(name, v, tuple(pkgs))
+                # Versions are unique, so sort on them alone
+                for v, pkgs in sorted(vers.items(), key=itemgetter(0))
             },
         )
 
 
+# Project pages can be fetched more than once in a process (e.g. one Walker
+# reused across several walks), but individual releases rarely change.  Reusing
+# the same ProjectVersion keeps memo_version_metadata hits cheap and avoids
+# holding duplicates.  Weak, so this never keeps anything alive on its own.
+_PROJECT_VERSIONS: WeakValueDictionary[
+    Tuple[CanonicalName, Version], ProjectVersion
+] = WeakValueDictionary()
+_PROJECT_VERSIONS_LOCK = threading.Lock()
+
+
+def _intern_project_version(
+    name: CanonicalName, version: Version, packages: Tuple[DistributionPackage, ...]
+) -> ProjectVersion:
+    with _PROJECT_VERSIONS_LOCK:
+        existing = _PROJECT_VERSIONS.get((name, version))
+        # Only reuse when the files are identical (they might have gained a
+        # wheel, or been yanked, since last time)
+        if existing is not None and existing.packages == packages:
+            return existing
+        pv = ProjectVersion(version, packages)
+        _PROJECT_VERSIONS[(name, version)] = pv
+        return pv
+
+
+# (Requires-Dist, Provides-Extra)
+_ParsedDeps = Tuple[Tuple[Requirement, ...], Tuple[str, ...]]
+
+
+# At most two slashes, e.g. "pkg-1.0/pkg.egg-info/requires.txt"
+# TODO: I can't remember why it's <= 2 rather than a specific count
+_REQUIRES_TXT_RE = re.compile(r"[^/]*/(?:[^/]*/)?requires\.txt\Z")
+
+
 def filter_requires_txt_names(names: List[str]) -> List[str]:
-    # TODO: I can't remember why it's <= 2 rather than a specific count
-    return [
-        name
-        for name in names
-        if name.endswith("/requires.txt") and name.count("/") <= 2
-    ]
+    match = _REQUIRES_TXT_RE.match
+    return [name for name in names if match(name)]
 
 
+# How cheaply (package_type, is_zip) gives up its metadata, when there's no
+# PEP 658 .metadata file (which scores 100).  Anything else is unusable.
+PACKAGE_SCORES: Dict[Tuple[Optional[str], bool], int] = {
+    ("wheel", True): 90,
+    ("wheel", False): 90,
+    ("sdist", True): 50,
+    ("sdist", False): 30,
+}
+
+
+# Not slots=True: _intern_project_version needs weak references, and
+# weakref_slot is only available from 3.11.
 @dataclass(frozen=True)
 class ProjectVersion:
     version: Version
     packages: Tuple[DistributionPackage, ...] = field(hash=False)
+    # These are derived from `packages` once, rather than scanning it on every
+    # access (requires_python in particular is read for every candidate).
+    # requires_python is None rather than "" when unconstrained.
+    requires_python: Optional[str] = field(init=False, compare=False)
+    yanked: bool = field(init=False, compare=False, repr=False)
+    has_sdist: bool = field(init=False, compare=False, repr=False)
+    has_wheel: bool = field(init=False, compare=False, repr=False)
+    # (Requires-Dist, Provides-Extra) once get_deps has parsed them; a release's
+    # files don't change, and ProjectVersions are interned, so this is kept
+    # rather than reading and parsing METADATA again.
+    _deps: Optional[_ParsedDeps] = field(
+        init=False, compare=False, repr=False, default=None
+    )
 
-    @property
-    def requires_python(self) -> Optional[str]:
-        return first((dp.requires_python for dp in self.packages), None)
-
-    @property
-    def yanked(self) -> bool:
-        return first((dp.is_yanked for dp in self.packages), False)
-
-    @property
-    def has_sdist(self) -> bool:
-        return any(dp.package_type == "sdist" for dp in self.packages)
-
-    @property
-    def has_wheel(self) -> bool:
-        return any(dp.package_type == "wheel" for dp in self.packages)
+    def __post_init__(self) -> None:
+        # One pass over the packages rather than one per attribute
+        requires_python: Optional[str] = None
+        yanked = has_sdist = has_wheel = False
+        for dp in self.packages:
+            if requires_python is None and dp.requires_python:
+                requires_python = dp.requires_python
+            yanked = yanked or dp.is_yanked
+            if dp.package_type == "sdist":
+                has_sdist = True
+            elif dp.package_type == "wheel":
+                has_wheel = True
+        object.__setattr__(self, "requires_python", requires_python)
+        object.__setattr__(self, "yanked", yanked)
+        object.__setattr__(self, "has_sdist", has_sdist)
+        object.__setattr__(self, "has_wheel", has_wheel)
 
     def get_deps(
         self, ps: PyPISimple, session: Session, extracted_metadata_cache: SimpleCache
     ) -> BasicMetadata:
+        # Races just parse twice
+        if (deps := self._deps) is None:
+            deps = self._load_deps(ps, session, extracted_metadata_cache)
+            object.__setattr__(self, "_deps", deps)
+        reqs, extras = deps
+        return BasicMetadata(
+            list(reqs), list(extras), has_sdist=self.has_sdist, has_wheel=self.has_wheel
+        )
+
+    def _load_deps(
+        self, ps: PyPISimple, session: Session, extracted_metadata_cache: SimpleCache
+    ) -> _ParsedDeps:
         best_pkg: Optional[DistributionPackage] = None
         best_score = 0
         with kev("score", count=len(self.packages)):
             for pkg in self.packages:
                 if pkg.has_metadata:
                     score = 100
-                elif pkg.package_type == "wheel":
-                    score = 90
-                elif pkg.package_type == "sdist" and pkg.filename.endswith(".zip"):
-                    score = 50
-                elif pkg.package_type == "sdist":
-                    score = 30
-                else:
+                elif not (
+                    score := PACKAGE_SCORES.get(
+                        (pkg.package_type, pkg.filename.endswith(".zip")), 0
+                    )
+                ):
                     LOG.debug("Cannot load metadata from %r", pkg.filename)
                     continue
                 assert pkg
@@ -130,7 +217,7 @@ class ProjectVersion:
                 self.version,
                 [dp.filename for dp in self.packages],
             )
-            return BasicMetadata()
+            return (), ()
 
         md: str
         # Ensure we don't accidentally use this later on; this was the source of a pesky cache bug
@@ -139,12 +226,22 @@ class ProjectVersion:
             if md_bytes := extracted_metadata_cache.get(best_pkg.url):
                 md = md_bytes.decode("utf-8")
             else:
-                with kev("pypi_simple.get_package_metadata"):
-                    # pypi-simple does the decode for you today; this wastes a
-                    # ton of time trying to guess charset, until
-                    # https://github.com/jwodder/pypi-simple/pull/22 is merged.
-                    md = ps.get_package_metadata(best_pkg)
-                    extracted_metadata_cache.set(best_pkg.url, md.encode("utf-8"))
+                with kev("pypi_simple.get_package_metadata_bytes"):
+                    # Store the bytes as served, rather than decoding them only
+                    # to encode them again for the cache.
+                    md_bytes = ps.get_package_metadata_bytes(best_pkg)
+                    extracted_metadata_cache.set(best_pkg.url, md_bytes)
+                md = md_bytes.decode("utf-8")
+        elif (
+            len(self.packages) == 1
+            and (
+                json_md := _metadata_from_pypi_json(
+                    best_pkg, session, extracted_metadata_cache
+                )
+            )
+            is not None
+        ):
+            md = json_md
         elif best_pkg.package_type == "wheel":
             # Wheels can be loaded incrementally, but also provide richer, more
             # reliable metadata.
@@ -152,12 +249,13 @@ class ProjectVersion:
                 md = md_bytes.decode("utf-8")
             else:
                 with kev("extract metadata remote", url=best_pkg.url):
-                    f = SeekableHttpFile(
+                    pf = _PrefetchingHttpFile(
                         best_pkg.url,
                         get_range=partial(get_range_requests, session=session),
                         check_etag=False,
                     )
-                    zf = ZipFile(f)  # type: ignore[arg-type,call-overload,unused-ignore]
+                    zf = ZipFile(pf)  # type: ignore[arg-type,call-overload,unused-ignore]
+                    _prefetch_wheel_metadata(pf, zf)
 
                     # These two lines come from warehouse itself
                     name, version, _ = best_pkg.filename.split("-", 2)
@@ -181,13 +279,7 @@ class ProjectVersion:
                         md_bytes = metadata_please.from_zip_sdist(zf)
                 else:
                     with kev("extract tar metadata", url=best_pkg.url):
-                        with tempfile.TemporaryDirectory() as d:
-                            local_path = Path(d, best_pkg.filename)
-                            ps.download_package(
-                                best_pkg, path=local_path, verify=bool(best_pkg.digests)
-                            )
-                            with TarFile.open(local_path) as tf:
-                                md_bytes = metadata_please.from_tar_sdist(tf)
+                        md_bytes = _metadata_from_tar_sdist_url(session, best_pkg)
 
                 extracted_metadata_cache.set(key, md_bytes)
                 md = md_bytes.decode("utf-8")
@@ -195,26 +287,301 @@ class ProjectVersion:
         else:
             raise NotImplementedError(best_pkg)
 
-        reqs: List[Requirement] = []
-        extras: List[str] = []
-        if md is not None:
-            with kev("transform"):
-                msg = message_from_string(md)
-                if t := msg.get_all("Requires-Dist"):
-                    for dep in t:
-                        try:
-                            reqs.append(Requirement(dep))
-                        except InvalidRequirement:
-                            LOG.warning(
-                                "Skipping invalid requirement %r",
-                                dep,
-                            )
-
-                if t := msg.get_all("Provides-Extra"):
-                    extras = t
-        return BasicMetadata(
-            reqs, extras, has_sdist=self.has_sdist, has_wheel=self.has_wheel
-        )
+        with kev("transform"):
+            return parse_metadata(md)
+
+
+def _metadata_from_pypi_json(
+    pkg: DistributionPackage, session: Session, extracted_metadata_cache: SimpleCache
+) -> Optional[str]:
+    """
+    For files on PyPI without PEP 658 metadata, the JSON API has the release's
+    Requires-Dist in one small response, rather than range requests into a
+    wheel or downloading a whole sdist.
+
+    The JSON API's requires_dist is per release, taken from one of its files,
+    so this is only trusted when `pkg` is the release's only file.  Otherwise
+    (and for other indexes, if PyPI doesn't know the deps, or on any error
+    fetching or parsing the response) returns None to fall back to extracting
+    from the file.
+    """
+    if (
+        pkg.project is None
+        or pkg.version is None
+        or urlsplit(pkg.url).hostname != "files.pythonhosted.org"
+    ):
+        return None
+    fallback_key = pkg.url if pkg.package_type == "wheel" else pkg.url + "#requires.txt"
+    if extracted_metadata_cache.get(fallback_key) is not None:
+        return None
+
+    key = pkg.url + "#json"
+    if (md_bytes := extracted_metadata_cache.get(key)) is not None:
+        return md_bytes.decode("utf-8")
+    url = f"https://pypi.org/pypi/{pkg.project}/{pkg.version}/json"
+    with kev("pypi json", url=url):
+        try:
+            resp = session.get(url)
+            resp.raise_for_status()
+            doc = _json_loads(resp.content)
+        except (RequestException, ValueError) as e:
+            LOG.debug("Ignoring PyPI JSON for %s: %r", pkg.filename, e)
+            return None
+    if not isinstance(doc, dict) or not isinstance(info := doc.get("info"), dict):
+        return None
+    files = doc.get("urls")
+    if not (
+        isinstance(files, list)
+        and len(files) == 1
+        and isinstance(files[0], dict)
+        and files[0].get("filename") == pkg.filename
+    ):
+        return None
+    if not isinstance(requires_dist := info.get("requires_dist"), list):
+        return None
+    buf = [f"Requires-Dist: {req}\n" for req in requires_dist]
+    for extra in info.get("provides_extra") or ():
+        buf.append(f"Provides-Extra: {extra}\n")
+    md = "".join(buf)
+    extracted_metadata_cache.set(key, md.encode("utf-8"))
+    return md
+
+
+class _DigestingReader:
+    """
+    Just enough of a file object over a response body for TarFile's stream
+    mode, hashing everything as it goes by.
+    """
+
+    def __init__(self, chunks: Iterator[bytes], pkg: DistributionPackage):
+        self._chunks = chunks
+        self._url = pkg.url
+        # Like pypi-simple's downloads, check every digest that hashlib knows.
+        self._digesters: Dict[str, Tuple[Any, str]] = {}
+        for alg, expected in pkg.digests.items():
+            try:
+                self._digesters[alg] = (hashlib.new(alg), expected)
+            except ValueError:
+                pass
+        self._buf = bytearray()
+
+    def _update(self, chunk: bytes) -> None:
+        for d, _ in self._digesters.values():
+            d.update(chunk)
+
+    def read(self, n: int = -1) -> bytes:
+        while n < 0 or len(self._buf) < n:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._update(chunk)
+            self._buf += chunk
+        if n < 0:
+            n = len(self._buf)
+        data = bytes(self._buf[:n])
+        del self._buf[:n]
+        return data
+
+    def finish(self) -> None:
+        """
+        Consume the rest of the body (the tar reader can stop before the end)
+        and verify digests.
+        """
+        for chunk in self._chunks:
+            self._update(chunk)
+        for alg, (d, expected) in self._digesters.items():
+            if (actual := d.hexdigest()) != expected:
+                raise DigestMismatchError(
+                    algorithm=alg,
+                    expected_digest=expected,
+                    actual_digest=actual,
+                    url=self._url,
+                )
+
+
+def _metadata_from_tar_sdist_url(session: Session, pkg: DistributionPackage) -> bytes:
+    """
+    Like metadata_please.from_tar_sdist, but decompresses as the sdist
+    downloads rather than saving it to a temporary file first.  Stream mode
+    can't seek back, so requires.txt contents are kept as they're seen (they're
+    small), with the shortest path winning as in metadata_please.
+    """
+    best_name: Optional[str] = None
+    requires_data = b""
+    with session.get(pkg.url, stream=True) as resp:
+        resp.raise_for_status()
+        reader = _DigestingReader(resp.iter_content(65536), pkg)
+        with TarFile.open(fileobj=reader, mode="r|*") as tf:  # type: ignore[arg-type,unused-ignore]
+            for ti in tf:
+                if (
+                    ti.isfile()
+                    and ti.name.endswith("/requires.txt")
+                    and (best_name is None or len(ti.name) < len(best_name))
+                ):
+                    fo = tf.extractfile(ti)
+                    assert fo is not None
+                    best_name, requires_data = ti.name, fo.read()
+        reader.finish()
+
+    if best_name is None:
+        return b""
+    # Hand just that file to metadata_please, so the METADATA it builds is
+    # exactly what from_tar_sdist would have given.
+    buf = io.BytesIO()
+    with TarFile(fileobj=buf, mode="w") as tf:
+        ti = TarInfo(best_name)
+        ti.size = len(requires_data)
+        tf.addfile(ti, io.BytesIO(requires_data))
+    buf.seek(0)
+    with TarFile(fileobj=buf) as tf:
+        return metadata_please.from_tar_sdist(tf)
+
+
+# Don't prefetch more than this; past that, the few separate reads ZipFile makes
+# are cheaper than downloading the whole span.
+MAX_WHEEL_METADATA_PREFETCH = 1_000_000
+
+# A zip local file header is this, then the name and extra field.
+ZIP_LOCAL_HEADER_SIZE = 30
+# The local extra field doesn't have to match the central directory's.
+ZIP_LOCAL_EXTRA_SLACK = 1024
+
+
+class _PrefetchingHttpFile(SeekableHttpFile):
+    """
+    A SeekableHttpFile that can also hold one range fetched up front (see
+    prefetch), serving reads that fall entirely inside it.  Everything else is
+    left to SeekableHttpFile.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        self._prefetch_start = 0
+        self._prefetch_data = b""
+        super().__init__(*args, **kwargs)
+
+    def prefetch(self, start: int, end: int) -> None:
+        """
+        Fetches bytes [start, end) in one request.
+        """
+        if not (0 <= start < end <= self.length):
+            return
+        self.stats["num_requests"] += 1
+        resp = self.get_range(self.url, "bytes=%d-%d" % (start, end - 1))
+        if resp.content is None or len(resp.content) != end - start:
+            # Leave it to the regular reads
+            return
+        self._prefetch_start = start
+        self._prefetch_data = resp.content
+
+    def read(self, n: int = -1) -> bytes:
+        p = self.pos - self._prefetch_start
+        if n >= 0 and p >= 0 and p + n <= len(self._prefetch_data):
+            self.stats["satisfied_from_cache"] += 1
+            self.pos += n
+            return self._prefetch_data[p : p + n]
+        return super().read(n)
+
+
+def _prefetch_wheel_metadata(f: _PrefetchingHttpFile, zf: ZipFile) -> None:
+    """
+    SeekableHttpFile only holds the last `precache` bytes of the file.  When
+    METADATA starts before that, ZipFile reads its local header, name, and data
+    separately, each being a range request; instead get all of them in one.
+    """
+    infos = [
+        zi
+        for zi in zf.infolist()
+        if zi.filename.endswith(".dist-info/METADATA") and zi.filename.count("/") == 1
+    ]
+    if not infos:
+        return
+    zi = min(infos, key=lambda zi: zi.header_offset)
+    tail_start = max(0, f.length - f.precache)
+    start = zi.header_offset
+    end = min(
+        tail_start,
+        start
+        + ZIP_LOCAL_HEADER_SIZE
+        + len(zi.orig_filename.encode("utf-8"))
+        + len(zi.extra)
+        + ZIP_LOCAL_EXTRA_SLACK
+        + zi.compress_size,
+    )
+    if 0 < end - start <= MAX_WHEEL_METADATA_PREFETCH:
+        f.prefetch(start, end)
+
+
+@lru_cache(maxsize=65536)
+def parse_version(version: str) -> Version:
+    """
+    Every file in a release carries the same version string (some releases
+    have dozens of wheels), so parse each distinct string once.
+    """
+    return Version(version)
+
+
+@lru_cache(maxsize=16384)
+def parse_requirement(req: str) -> Requirement:
+    """
+    The same Requires-Dist strings (e.g. "numpy>=1.20") show up across many
+    projects and versions, so share one parsed (read-only!) object per string.
+    """
+    return Requirement(req)
+
+
+def iter_metadata_headers(md: str) -> Iterator[Tuple[str, str]]:
+    """
+    Yields (lowercased name, value) for the headers of METADATA text.
+
+    This is a small subset of what email.message_from_string does, but that is
+    a general-purpose parser which also reads (potentially huge) descriptions
+    that we don't care about.  Headers end at the first blank line (or
+    non-header line), and folded continuation lines are unfolded.
+    """
+    name: Optional[str] = None
+    value = ""
+    for line in md.split("\n"):
+        line = line.rstrip("\r")
+        if line[:1] in (" ", "\t") and name is not None:
+            value += line
+            continue
+        if name is not None:
+            yield name, value
+            name = None
+        k, sep, v = line.partition(":")
+        if not sep:
+            break
+        name = k.lower()
+        value = v.lstrip()
+    if name is not None:
+        yield name, value
+
+
+def parse_metadata(md: str) -> _ParsedDeps:
+    """
+    Returns the (Requires-Dist, Provides-Extra) values from METADATA text.
+
+    The Requirement objects come from parse_requirement, so are shared and must
+    be treated as read-only.
+    """
+    requires_dist: List[str] = []
+    extras: List[str] = []
+    # One lookup per header, rather than a comparison per wanted name
+    wanted = {"requires-dist": requires_dist.append, "provides-extra": extras.append}
+    for name, value in iter_metadata_headers(md):
+        if (append := wanted.get(name)) is not None:
+            append(value)
+
+    reqs: List[Requirement] = []
+    for value in requires_dist:
+        try:
+            reqs.append(parse_requirement(value))
+        except InvalidRequirement:
+            LOG.warning(
+                "Skipping invalid requirement %r",
+                value,
+            )
+    return tuple(reqs), tuple(extras)
 
 
 def convert_sdist_requires(data: str) -> Tuple[List[str], Set[str]]:
@@ -224,11 +591,11 @@ def convert_sdist_requires(data: str) -> Tuple[List[str], Set[str]]:
     current_markers = None
     extras: Set[str] = set()
     lst: List[str] = []
-    for line in data.splitlines():
-        line = line.strip()
+    # Stripping via map() keeps that loop in C
+    for line in map(str.strip, data.splitlines()):
         if not line:
             continue
-        elif line[:1] == "[" and line[-1:] == "]":
+        elif line[0] == "[" and line[-1] == "]":
             current_markers = line[1:-1]
             if ":" in current_markers:
                 # absl-py==0.9.0 and requests==2.22.0 are good examples of this
@@ -249,7 +616,7 @@ def convert_sdist_requires(data: str) -> Tuple[List[str], Set[str]]:
     return lst, extras
 
 
-@dataclass
+@dataclass(slots=True)
 class BasicMetadata:
     reqs: Sequence[Requirement] = ()
     extras: Sequence[str] = ()
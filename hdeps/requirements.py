@@ -2,9 +2,10 @@
 # thing here to avoid extra deps or fragile APIs, at the expense of missing some
 # deps and false-positives.
 
+import os
 from glob import glob
 from pathlib import Path
-from typing import Iterator
+from typing import IO, Iterator, List, Union
 
 from packaging.requirements import Requirement
 from packaging.utils import canonicalize_name
@@ -13,11 +14,15 @@ from packaging.utils import canonicalize_name
 # couple and return sets instead.
 
 
-def _iter_simple_requirements(path: Path) -> Iterator[Requirement]:
-    for line in path.read_text().splitlines():
-        line = line.split("#", 1)[0].strip()
-        if not line:
+def _iter_simple_requirements(path: Union[Path, IO[bytes]]) -> Iterator[Requirement]:
+    # Comments and blank lines are dropped while still bytes; only the
+    # surviving lines get decoded.
+    data = path.read_bytes() if isinstance(path, Path) else path.read()
+    for raw_line in data.splitlines():
+        raw_line = raw_line.partition(b"#")[0].strip()
+        if not raw_line:
             continue
+        line = raw_line.decode("utf-8")
         if line.startswith("-"):
             print("Ignoring", line)
             continue
@@ -26,9 +31,10 @@ def _iter_simple_requirements(path: Path) -> Iterator[Requirement]:
         yield Requirement(line)
 
 
-def iter_requirement_names(path: Path) -> Iterator[str]:
+def iter_requirement_names(path: Union[Path, IO[bytes]]) -> Iterator[str]:
     """
-    Returns the canonical names from the given requirements.txt
+    Returns the canonical names from the given requirements.txt (a path, or an
+    already-open binary file)
     """
     # TODO support, or document non-support, for git references
 
@@ -36,10 +42,33 @@ def iter_requirement_names(path: Path) -> Iterator[str]:
         yield canonicalize_name(req.name)
 
 
+def _glob(pattern: str) -> List[str]:
+    """
+    Like glob(), but the common "dir/*suffix" form is a single scandir, without
+    glob's per-entry work.  Anything else (and case-insensitive Windows) goes to
+    glob.
+    """
+    dirname, basename = os.path.split(pattern)
+    suffix = basename[1:]
+    if (
+        os.name == "nt"
+        or basename[:1] != "*"
+        or any(c in dirname or c in suffix for c in "*?[")
+    ):
+        return glob(pattern)
+    try:
+        with os.scandir(dirname or os.curdir) as it:
+            # glob's "*" doesn't match hidden files
+            names = [e.name for e in it if e.name.endswith(suffix) and e.name[0] != "."]
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+    return [os.path.join(dirname, n) for n in names]
+
+
 def iter_glob_all_requirement_names(comma_separated_patterns: str) -> Iterator[str]:
     for pattern in comma_separated_patterns.split(","):
         if pattern:
-            for filename in sorted(glob(pattern)):
+            for filename in sorted(_glob(pattern)):
                 # We can't just use Path.glob because you mgiht pass
                 # 'reqs/*.txt' and this is considered a non-relative pattern.
                 yield from iter_requirement_names(Path(filename))
@@ -1,32 +1,39 @@
+from __future__ import annotations
+
 import logging
 import threading
 from collections import defaultdict, deque
-from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import Future
 
 from pathlib import Path
-from typing import Any, Dict, Iterable, Optional, Set, Tuple
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
 import click
 
 from keke import kev, ktrace
 
 from packaging.requirements import Requirement
-from packaging.utils import canonicalize_name
 from packaging.version import Version
 from pypi_simple import NoSuchProjectError, PyPISimple
 from requests.sessions import Session
 from vmodule import VLOG_1, VLOG_2
 
-# from tpe_prio import ThreadPoolExecutor
-
 from .cache import SimpleCache
 
 from .compatibility import find_best_compatible_version, NoMatchingRelease
+from .executor import DEFAULT_PRIORITY, PREFETCH_PRIORITY, PriorityThreadPoolExecutor
 from .markers import EnvironmentMarkers
-from .projects import BasicMetadata, Project, ProjectVersion
+from .projects import BasicMetadata, parse_version, Project, ProjectVersion
 from .requirements import _iter_simple_requirements
 from .session import get_retry_session
-from .types import CanonicalName, Choice, ChoiceKeyType, Edge, VersionCallback
+from .types import (
+    canonical_name,
+    CanonicalName,
+    Choice,
+    ChoiceKeyType,
+    Edge,
+    VersionCallback,
+)
 
 LOG = logging.getLogger(__name__)
 
@@ -39,6 +46,34 @@ def _all_current_versions_unknown(cn: CanonicalName) -> Optional[str]:
     return None
 
 
+class _Path:
+    """
+    The choices from the root down to some point in the walk, as an immutable
+    linked list so that every child can share its parent's path (rather than
+    copying a set per edge).  Dep chains are short, so the linear membership
+    check is cheap.
+    """
+
+    __slots__ = ("key", "parent")
+
+    def __init__(self, key: ChoiceKeyType, parent: Optional[_Path]) -> None:
+        self.key = key
+        self.parent = parent
+
+    def __contains__(self, key: ChoiceKeyType) -> bool:
+        node: Optional[_Path] = self
+        while node is not None:
+            if node.key == key:
+                return True
+            node = node.parent
+        return False
+
+
+# (parent, name, req, source, parent_path).  A plain tuple, which is several
+# times cheaper to build and unpack than a slotted class.
+_QueueItem = Tuple[Choice, CanonicalName, Requirement, str, _Path]
+
+
 class Walker:
     def __init__(
         self,
@@ -51,8 +86,12 @@ class Walker:
         color: Optional[bool] = None,
     ):
         self.root = Choice(CanonicalName("-"), Version("0"))
-        self.pool = ThreadPoolExecutor(max_workers=parallelism)
+        # Work that drain() is about to wait on goes ahead of prefetches.
+        self.pool = PriorityThreadPoolExecutor(max_workers=parallelism)
         self.env_markers = env_markers
+        # Parsed once rather than for every requirement
+        assert env_markers.parsed_python_full_version is not None
+        self.python_version = env_markers.parsed_python_full_version
         self.pypi_simple = pypi_simple
         self.uncached_session = uncached_session or get_retry_session()
         self.extracted_metadata_cache = extracted_metadata_cache or SimpleCache()
@@ -61,10 +100,9 @@ class Walker:
         self.memo_fetch: Dict[CanonicalName, Future[Optional[Project]]] = {}
         self.memo_fetch_lock = threading.Lock()
         self.memo_version_metadata: Dict[ProjectVersion, Future[BasicMetadata]] = {}
+        self.memo_version_metadata_lock = threading.Lock()
 
-        self.queue: deque[
-            Tuple[Choice, CanonicalName, Requirement, str, Set[ChoiceKeyType]]
-        ] = deque()
+        self.queue: deque[_QueueItem] = deque()
         self.current_version_callback = current_version_callback
         self.known_conflicts: Dict[CanonicalName, Set[Version]] = defaultdict(set)
 
@@ -76,23 +114,63 @@ class Walker:
         self.feed_from(_iter_simple_requirements(req_file), str(req_file))
 
     def feed_from(self, reqs: Iterable[Requirement], source: str = "arg") -> None:
-        for req in reqs:
-            self.feed(req, source)
+        # Like calling feed() for each, but the fetches are submitted as one
+        # batch.
+        names = [name for req in reqs if (name := self._enqueue(req, source))]
+        self._schedule_fetches(names, False)
 
     def feed(self, req: Requirement, source: str = "arg") -> None:
-        name = CanonicalName(canonicalize_name(req.name))
+        if name := self._enqueue(req, source):
+            self._schedule_fetch(name, False)
+
+    def _enqueue(self, req: Requirement, source: str) -> Optional[CanonicalName]:
+        """
+        Queues `req` for drain(), returning its name if the caller needs to
+        schedule a fetch (or None if it doesn't apply to this environment).
+        """
+        name = canonical_name(req.name)
         LOG.log(VLOG_1, "Feed %s (%r) from %s", name, str(req), source)
         if req.marker and not self.env_markers.match(req.marker):
-            return
+            return None
+
+        self.queue.append((self.root, name, req, source, _Path(self.root.key(), None)))
+        return name
+
+    def _schedule_fetch(self, name: CanonicalName, proactive: bool) -> None:
+        self._schedule_fetches((name,), proactive)
 
+    def _schedule_fetches(
+        self, names: Iterable[CanonicalName], proactive: bool
+    ) -> None:
+        # Once scheduled, an entry is never replaced, so the unlocked check is
+        # safe and keeps the common (already scheduled) case off the lock.  The
+        # lock only serializes insertion, so a project is fetched just once;
+        # it's taken once per batch rather than once per name.
+        missing = [name for name in names if name not in self.memo_fetch]
+        if not missing:
+            return
+        priority = PREFETCH_PRIORITY if proactive else DEFAULT_PRIORITY
         with self.memo_fetch_lock:
-            if name not in self.memo_fetch:
-                self.memo_fetch[name] = self.pool.submit(
-                    self._fetch_project, name, False
-                )
+            for name in missing:
+                if name not in self.memo_fetch:
+                    self.memo_fetch[name] = self.pool.submit_with_priority(
+                        priority, self._fetch_project, name, proactive
+                    )
 
-        empty_set: Set[ChoiceKeyType] = set()
-        self.queue.append((self.root, name, req, source, empty_set))
+    def _schedule_metadata(
+        self, project_name: CanonicalName, version: ProjectVersion, priority: int
+    ) -> Future[BasicMetadata]:
+        # Called from both drain() and pool threads (for the latest version);
+        # insertion is locked like memo_fetch so that only one of them submits.
+        if (fut := self.memo_version_metadata.get(version)) is not None:
+            return fut
+        with self.memo_version_metadata_lock:
+            if (fut := self.memo_version_metadata.get(version)) is None:
+                fut = self.pool.submit_with_priority(
+                    priority, self._fetch_project_metadata, project_name, version
+                )
+                self.memo_version_metadata[version] = fut
+        return fut
 
     @ktrace("project_name", "proactive", shortname=True)
     def _fetch_project(
@@ -105,14 +183,8 @@ class Walker:
         project = Project.from_pypi_simple_project_page(project_page)
         # It's extremely likely that we will subsequently look up the deps of
         # the most recent version, so go ahead and schedule the metadata fetch.
-        if project.versions:
-            latest_version_key = max(project.versions)
-            latest_version = project.versions[latest_version_key]
-
-            if latest_version not in self.memo_version_metadata:
-                self.memo_version_metadata[latest_version] = self.pool.submit(
-                    self._fetch_project_metadata, project_name, latest_version
-                )
+        if (latest_version := project.latest_version) is not None:
+            self._schedule_metadata(project_name, latest_version, PREFETCH_PRIORITY)
 
         LOG.log(VLOG_1, "_fetch_project done %s", project_name)
         return project
@@ -128,18 +200,15 @@ class Walker:
         # this version, so go ahead and schedule that too.  (But not with any
         # extras.)
         with kev("prefetch", count=len(md.reqs)):
+            to_schedule: List[CanonicalName] = []
             for req in md.reqs:
-                name = CanonicalName(canonicalize_name(req.name))
+                name = canonical_name(req.name)
                 # Don't bother with markers if we've already scheduled
                 if name not in self.memo_fetch:
                     # Marker evaluation is relatively expensive
                     if self.env_markers.match(req.marker):
-                        # Check again under the lock (for correctness, and since some time has elapsed)
-                        with self.memo_fetch_lock:
-                            if name not in self.memo_fetch:
-                                self.memo_fetch[name] = self.pool.submit(
-                                    self._fetch_project, name, True
-                                )
+                        to_schedule.append(name)
+            self._schedule_fetches(to_schedule, True)
 
         LOG.log(
             VLOG_1, "_fetch_project_metadata done %s %s", project_name, version.version
@@ -148,15 +217,22 @@ class Walker:
 
     def drain(self) -> None:
         chosen: Dict[CanonicalName, Version] = {}
+        # Checked once rather than per item; formatting is already deferred,
+        # but the call and level check still add up.
+        log_info = LOG.isEnabledFor(logging.INFO)
 
         while self.queue:
-            (parent, name, req, source, parent_keys) = self.queue.popleft()
-            LOG.info(
-                "process %s %s from %s with extras %s", name, req, source, req.extras
-            )
+            (parent, name, req, source, parent_path) = self.queue.popleft()
+            if log_info:
+                LOG.info(
+                    "process %s %s from %s with extras %s",
+                    name,
+                    req,
+                    source,
+                    req.extras,
+                )
             fut = self.memo_fetch[name]
-            if hasattr(self.pool, "bump"):
-                self.pool.bump(fut)
+            self.pool.bump(fut)
             with kev("project result", project_name=name):
                 project = fut.result()
 
@@ -165,12 +241,14 @@ class Walker:
                 continue
 
             cur = chosen.get(name)
-            with kev("find_best_compatible_version", project_name=name, req=str(req)):
+            # kev only stringifies its args when tracing is enabled, so pass the
+            # objects themselves.
+            with kev("find_best_compatible_version", project_name=name, req=req):
                 try:
                     version = find_best_compatible_version(
                         project,
                         req,
-                        self.env_markers,
+                        self.python_version,
                         cur,
                         self.current_version_callback,
                     )
@@ -183,7 +261,7 @@ class Walker:
                 choice, specifier=req.specifier, markers=req.marker, note=source
             )
             parent.deps.append(edge)
-            if choice.key() in parent_keys:
+            if choice.key() in parent_path:
                 LOG.info("Avoid circular dep processing %s", name)
                 continue
 
@@ -193,67 +271,76 @@ class Walker:
             chosen[name] = version
 
             if t := project.versions.get(version):
-                if t not in self.memo_version_metadata:
-                    fut2 = self.pool.submit(self._fetch_project_metadata, name, t)
-                    self.memo_version_metadata[t] = fut2
-                else:
-                    fut2 = self.memo_version_metadata[t]
-
-                if hasattr(self.pool, "bump"):
-                    self.pool.bump(fut2)
-                with kev("ver result", project_name=name, project_version=str(version)):
+                fut2 = self._schedule_metadata(name, t, DEFAULT_PRIORITY)
+                self.pool.bump(fut2)
+                with kev("ver result", project_name=name, project_version=version):
                     md = fut2.result()
 
                 choice.has_sdist = md.has_sdist
                 choice.has_wheel = md.has_wheel
+                path = _Path(choice.key(), parent_path)
+                to_schedule: List[CanonicalName] = []
+                # Checked once rather than three times per requirement
+                vlog_2 = LOG.isEnabledFor(VLOG_2)
+                req_extras = tuple(sorted(req.extras))
                 for r in md.reqs:
-                    r_name = CanonicalName(canonicalize_name(r.name))
-                    LOG.log(
-                        VLOG_2,
-                        "  drain possible requirement %s -> %s (%s)",
-                        name,
-                        r_name,
-                        r,
-                    )
-                    if self.env_markers.match(r.marker, sorted(req.extras)):
-                        with self.memo_fetch_lock:
-                            if r_name not in self.memo_fetch:
-                                fut = self.pool.submit(
-                                    self._fetch_project, r_name, False
-                                )
-                                self.memo_fetch[r_name] = fut
-
-                        self.queue.append(
-                            (choice, r_name, r, "dep", parent_keys | {choice.key()})
+                    r_name = canonical_name(r.name)
+                    if vlog_2:
+                        LOG.log(
+                            VLOG_2,
+                            "  drain possible requirement %s -> %s (%s)",
+                            name,
+                            r_name,
+                            r,
                         )
+                    if self.env_markers.match(r.marker, req_extras):
+                        to_schedule.append(r_name)
+                        self.queue.append((choice, r_name, r, "dep", path))
 
-                        LOG.log(VLOG_2, "    keep")
-                    else:
+                        if vlog_2:
+                            LOG.log(VLOG_2, "    keep")
+                    elif vlog_2:
                         LOG.log(VLOG_2, "    omit")
+                self._schedule_fetches(to_schedule, False)
 
     def print_flat(
         self,
         choice: Optional[Choice] = None,
-        seen: Optional[
-            Set[Tuple[CanonicalName, Version, Optional[Tuple[str, ...]]]]
-        ] = None,
+        seen: Optional[Set[Choice]] = None,
     ) -> None:
         if choice is None:
             choice = self.root
+        if seen is None:
             seen = set()
 
-        assert seen is not None
-        # Simple recursive postorder
-        for x in choice.deps:
-            key = (x.target.project, x.target.version, x.target.extras)
-            flag = key in seen
-            seen.add(key)
+        # Postorder, with an explicit stack rather than recursion: each entry
+        # is the remaining deps at that level, and the line to print once
+        # they're done.  Lines are collected and printed with a single write.
+        lines: List[str] = []
+        stack: List[Tuple[Iterator[Edge], Optional[str]]] = [(iter(choice.deps), None)]
+        while stack:
+            deps, line = stack[-1]
+            x = next(deps, None)
+            if x is None:
+                stack.pop()
+                if line is not None:
+                    lines.append(line)
+                continue
+
+            flag = x.target in seen
+            seen.add(x.target)
 
-            if x.target.deps:
-                self.print_flat(x.target, seen)
             dep_extras = f"[{', '.join(x.target.extras)}]" if x.target.extras else ""
-            if not flag:
-                print(f"{x.target.project}{dep_extras}=={x.target.version}")
+            line = (
+                None if flag else f"{x.target.project}{dep_extras}=={x.target.version}"
+            )
+            if x.target.deps:
+                stack.append((iter(x.target.deps), line))
+            elif line is not None:
+                lines.append(line)
+
+        if lines:
+            print("\n".join(lines))
 
     COLORS: Dict[Optional[str], Optional[str]] = {
         "conflict": "magenta",
@@ -288,71 +375,94 @@ class Walker:
         )
         click.echo()
 
+    def _format_line(
+        self, prefix: str, x: Edge, color_choice: Optional[str], dep_stuff: str
+    ) -> str:
+        return (
+            prefix
+            + click.style(x.target.project, fg=self.COLORS[color_choice])
+            + dep_stuff
+            + (
+                f" [{color_choice}]"
+                # N.b. self.color is intentionally tri-state -- None
+                # being autodetect in click and we assume it will be
+                # enabled thus don't output names here.
+                if color_choice and self.color is False
+                else ""
+            )
+        )
+
     def print_tree(
         self,
         choice: Optional[Choice] = None,
-        seen: Optional[
-            Set[Tuple[CanonicalName, Version, Optional[Tuple[str, ...]]]]
-        ] = None,
+        seen: Optional[Set[Choice]] = None,
         known_conflicts: Dict[CanonicalName, Set[Version]] = defaultdict(set),
         depth: int = 0,
     ) -> None:
-        prefix = ". " * depth
         if choice is None:
             choice = self.root
             seen = set()
             known_conflicts = self.known_conflicts
 
         assert seen is not None
-        # Inorder, but avoid doing duplicate work...
-        for x in choice.deps:
+        # Inorder, but avoid doing duplicate work...  This uses an explicit
+        # stack (of the remaining deps at each depth) rather than recursion.
+        # Lines are collected and echoed at once rather than one write each;
+        # click.echo still decides whether to strip the styling.
+        lines: List[str] = []
+        stack: List[Tuple[Iterator[Edge], int]] = [(iter(choice.deps), depth)]
+        while stack:
+            deps, depth = stack[-1]
+            x = next(deps, None)
+            if x is None:
+                stack.pop()
+                continue
+
+            prefix = ". " * depth
             # TODO display whether install or build dep, and whether pin disallows
             # current version, has compatible bdist, no sdist, etc
-            key = (x.target.project, x.target.version, x.target.extras)
             dep_extras = (
                 f"[{', '.join(sorted(x.target.extras))}]" if x.target.extras else ""
             )
 
-            def print_line(color_choice: Optional[str], dep_stuff: Any) -> None:
-                click.echo(
-                    prefix
-                    + click.style(x.target.project, fg=self.COLORS[color_choice])
-                    + dep_stuff
-                    + (
-                        f" [{color_choice}]"
-                        # N.b. self.color is intentionally tri-state -- None
-                        # being autodetect in click and we assume it will be
-                        # enabled thus don't output names here.
-                        if color_choice and self.color is False
-                        else ""
+            if x.target in seen:
+                lines.append(
+                    self._format_line(
+                        prefix,
+                        x,
+                        "conflict"
+                        if x.target.project in known_conflicts and x.specifier
+                        else None,
+                        f"{dep_extras} (=={x.target.version}) (already listed){' ; ' + str(x.markers) if x.markers else ''} via "
+                        + click.style(x.specifier or "*", fg="yellow"),
                     )
                 )
-
-            if key in seen:
-                print_line(
-                    "conflict" if key[0] in known_conflicts and x.specifier else None,
-                    f"{dep_extras} (=={x.target.version}) (already listed){' ; ' + str(x.markers) if x.markers else ''} via "
-                    + click.style(x.specifier or "*", fg="yellow"),
-                )
             else:
-                if key[0] in known_conflicts:
+                if x.target.project in known_conflicts:
                     # conflicting decision
                     color = "conflict"
                 else:
                     cur = self.current_version_callback(x.target.project)
-                    if cur and Version(cur) == x.target.version:
+                    if cur and parse_version(cur) == x.target.version:
                         color = "have_reuse"
                     else:
                         color = "no_sdist" if not x.target.has_sdist else "good"
-                seen.add(key)
-
-                print_line(
-                    color,
-                    f"{dep_extras} (=={x.target.version}){' ; ' + str(x.markers) if x.markers else ''} via "
-                    + click.style(x.specifier or "*", fg="yellow")
-                    + click.style(
-                        " no whl" if not x.target.has_wheel else "", fg="blue"
-                    ),
+                seen.add(x.target)
+
+                lines.append(
+                    self._format_line(
+                        prefix,
+                        x,
+                        color,
+                        f"{dep_extras} (=={x.target.version}){' ; ' + str(x.markers) if x.markers else ''} via "
+                        + click.style(x.specifier or "*", fg="yellow")
+                        + click.style(
+                            " no whl" if not x.target.has_wheel else "", fg="blue"
+                        ),
+                    )
                 )
                 if x.target.deps:
-                    self.print_tree(x.target, seen, known_conflicts, depth + 1)
+                    stack.append((iter(x.target.deps), depth + 1))
+
+        if lines:
+            click.echo("\n".join(lines))
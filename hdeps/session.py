@@ -7,31 +7,55 @@ from requests.adapters import HTTPAdapter, Retry
 from requests.sessions import Session
 
 
-def get_cached_retry_session(cache_dir: Optional[str] = None) -> Session:
+# Enough that a --parallelism worth of threads never waits on a connection
+DEFAULT_POOL_MAXSIZE = 100
+# Number of hosts to keep pools for.  We only talk to a handful (the index and
+# wherever it hosts files), so requests' default is plenty; this does not
+# depend on parallelism.
+DEFAULT_POOL_CONNECTIONS = 10
+
+
+def get_cached_retry_session(
+    cache_dir: Optional[str] = None,
+    pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+    pool_connections: int = DEFAULT_POOL_CONNECTIONS,
+) -> Session:
     if not cache_dir:
         cache_dir = appdirs.user_cache_dir("hdeps", "python-packaging")
 
     sess = Session()
-    # Settings copied from pip/_internal/network/session.py
+    # Settings copied from pip/_internal/network/session.py, plus 429 since we
+    # make many concurrent requests (urllib3 honors Retry-After)
     retries = Retry(
-        total=3, backoff_factor=0.25, status_forcelist=[500, 502, 503, 520, 527]
+        total=3, backoff_factor=0.25, status_forcelist=[429, 500, 502, 503, 520, 527]
     )
     assert cache_dir is not None
     cache_adapter = CacheControlAdapter(
-        cache=SeparateBodyFileCache(cache_dir), max_retries=retries, pool_maxsize=100
+        cache=SeparateBodyFileCache(cache_dir),
+        max_retries=retries,
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
     )
     sess.mount("https://", cache_adapter)
     sess.mount("http://", cache_adapter)
     return sess
 
 
-def get_retry_session() -> Session:
+def get_retry_session(
+    pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+    pool_connections: int = DEFAULT_POOL_CONNECTIONS,
+) -> Session:
     sess = Session()
-    # Settings copied from pip/_internal/network/session.py
+    # Settings copied from pip/_internal/network/session.py, plus 429 since we
+    # make many concurrent requests (urllib3 honors Retry-After)
     retries = Retry(
-        total=3, backoff_factor=0.25, status_forcelist=[500, 502, 503, 520, 527]
+        total=3, backoff_factor=0.25, status_forcelist=[429, 500, 502, 503, 520, 527]
+    )
+    adapter = HTTPAdapter(
+        max_retries=retries,
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
     )
-    adapter = HTTPAdapter(max_retries=retries, pool_maxsize=100)
     sess.mount("https://", adapter)
     sess.mount("http://", adapter)
     return sess
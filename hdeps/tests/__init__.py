@@ -1,6 +1,8 @@
 from .cache import SimpleCacheTest
+from .checkout import CheckoutTest
 from .cli_scenarios import CliScenariosTest
 from .compatibility import CompatibilityTest
+from .executor import PriorityThreadPoolExecutorTest
 from .markers import EnvironmentMarkersTest
 from .projects import ProjectMetadataTest
 from .requirements import RequirementsTest
@@ -9,9 +11,11 @@ from .resolution import ResolutionTest
 # from .session import LiveSessionTest
 
 __all__ = [
+    "CheckoutTest",
     "CliScenariosTest",
     "CompatibilityTest",
     "EnvironmentMarkersTest",
+    "PriorityThreadPoolExecutorTest",
     "SimpleCacheTest",
     "RequirementsTest",
     "ResolutionTest",
@@ -1,11 +1,40 @@
 import io
+from functools import lru_cache
 from pathlib import Path
-from typing import Any
+from typing import Any, ClassVar, Dict, Tuple
 
 from requests import Response, Session
 
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+@lru_cache(maxsize=None)
+def _resolve(url: str, fixture_root: Path) -> Tuple[Path, bool]:
+    """
+    Returns the fixture that serves `url`, and whether it's text.  The same
+    urls are requested over and over, so this is memoized.
+    """
+    # This is intended to "serve" any files from fixture_root, but git
+    # checkouts on windows with core.autocrlf alter the line endings of
+    # files it thinks are text.  We need the checksums of some text files
+    # like the mime documents *.metadata to be consistent.
+    if url.endswith(".metadata"):
+        return fixture_root / url.split("/")[-1], True
+    elif url.endswith((".gz", ".zip", ".whl")):
+        return fixture_root / url.split("/")[-1], False
+    elif "/simple/" in url:
+        project = url.strip("/").split("/")[-1]
+        return fixture_root / f"{project}.html", True
+    else:
+        raise ValueError(f"Unhandled path {url}")
+
 
 class FakeSession:
+    # Fixture contents (after line ending fixups) by path.  Fixtures don't
+    # change during a run, and most tests make a new session, so this is
+    # shared by all of them.
+    _data: ClassVar[Dict[Path, bytes]] = {}
+
     def __init__(self, fixture_root: Path) -> None:
         self.fixture_root = fixture_root
 
@@ -18,34 +47,20 @@ class FakeSession:
     def get(
         self, url: str, headers: Any = {}, timeout: float = 0, stream: bool = False
     ) -> Response:
-        # This is intended to "serve" any files from self.fixture_root, but git
-        # checkouts on windows with core.autocrlf alter the line endings of
-        # files it thinks are text.  We need the checksums of some text files
-        # like the mime documents *.metadata to be consistent.
         if headers is None:
             headers = {}
-        text = True
-        if url.endswith(".metadata"):
-            parts = url.split("/")
-            local_path = self.fixture_root / parts[-1]
-        elif url.endswith((".gz", ".zip", ".whl")):
-            parts = url.split("/")
-            local_path = self.fixture_root / parts[-1]
-            text = False
-        elif "/simple/" in url:
-            project = url.strip("/").split("/")[-1]
-            local_path = self.fixture_root / f"{project}.html"
-        else:
-            raise ValueError(f"Unhandled path {url}")
+        local_path, text = _resolve(url, self.fixture_root)
 
-        if not local_path.exists():
-            resp = Response()
-            resp.status_code = 404
-            return resp
+        if (data := self._data.get(local_path)) is None:
+            if not local_path.exists():
+                resp = Response()
+                resp.status_code = 404
+                return resp
 
-        data = local_path.read_bytes()
-        if text:
-            data = data.replace(b"\r\n", b"\n")
+            data = local_path.read_bytes()
+            if text:
+                data = data.replace(b"\r\n", b"\n")
+            self._data[local_path] = data
 
         length = str(len(data))
 
@@ -57,16 +72,16 @@ class FakeSession:
             assert not text
             resp.status_code = 206
             x = range.rsplit("=", 1)[-1]
-            if x[0] == "-":
+            a, b = x.split("-", 1)
+            if not a:
                 # bytes from end
-                start = max(0, len(data) + int(x))
-                data = data[int(x) :]
+                start = max(0, len(data) - int(b))
+                end = len(data) - 1
             else:
-                a, b = x.split("-", 1)
                 start = int(a)
-                data = data[int(a) : int(b) + 1]
-            # TODO make these better numbers
-            resp.headers["content-range"] = f"bytes {start}-1/{length}"
+                end = min(int(b), len(data) - 1)
+            data = data[start : end + 1]
+            resp.headers["content-range"] = f"bytes {start}-{end}/{length}"
 
         resp.raw = io.BytesIO(data)
         resp.headers["content-type"] = "text/html"
@@ -74,5 +89,7 @@ class FakeSession:
         return resp
 
 
-def get_fake_session_fixtures() -> Session:
-    return FakeSession(Path(__file__).parent / "fixtures")  # type: ignore
+def get_fake_session_fixtures(*args: Any, **kwargs: Any) -> Session:
+    # Stands in for the real session factories, so takes (and ignores) their
+    # arguments.
+    return FakeSession(FIXTURES)  # type: ignore
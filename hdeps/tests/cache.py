@@ -1,9 +1,10 @@
 import tempfile
 
 import unittest
+from hashlib import sha1
 from pathlib import Path
 
-from ..cache import SimpleCache
+from ..cache import SimpleCache, ZSTD_MAGIC
 
 
 class SimpleCacheTest(unittest.TestCase):
@@ -12,28 +13,30 @@ class SimpleCacheTest(unittest.TestCase):
             pd = Path(d)
 
             c = SimpleCache(pd)
+            # The defaults depend on whether blake3/zstandard are installed; pin
+            # them so the on-disk layout below is stable.
+            c.hash_factory = sha1
+            c.compress = False
 
             self.assertEqual(None, c.get("foo"))
             c.set("foo", b"value\n")
             self.assertEqual(b"value\n", c.get("foo"))
 
             self.assertEqual(
-                pd
-                / "0"
-                / "b"
-                / "e"
-                / "e"
-                / "c"
-                / "0beec7b5ea3f0fdbc95d0dd47f3c5bc275da8a33",
+                pd / "v2-sha1" / "0b" / "0beec7b5ea3f0fdbc95d0dd47f3c5bc275da8a33",
                 c._local_path("foo"),
             )
             self.assertEqual(6, c._local_path("foo").stat().st_size)
+            # memoized
+            self.assertIs(c._local_str("foo"), c._local_str("foo"))
 
     def test_basic_suffix(self) -> None:
         with tempfile.TemporaryDirectory() as d:
             pd = Path(d)
 
             c = SimpleCache(pd, suffix="suf")
+            c.hash_factory = sha1
+            c.compress = False
 
             self.assertEqual(None, c.get("foo"))
             c.set("foo", b"value\n")
@@ -42,16 +45,86 @@ class SimpleCacheTest(unittest.TestCase):
             self.assertEqual(
                 pd
                 / "suf"
-                / "0"
-                / "b"
-                / "e"
-                / "e"
-                / "c"
+                / "v2-sha1"
+                / "0b"
                 / "0beec7b5ea3f0fdbc95d0dd47f3c5bc275da8a33",
                 c._local_path("foo"),
             )
             self.assertEqual(6, c._local_path("foo").stat().st_size)
 
+    def test_negative_cache(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            c = SimpleCache(Path(d))
+
+            self.assertEqual(None, c.get("foo"))
+            # Written behind our back; the remembered miss wins until set()
+            p = c._local_path("foo")
+            p.parent.mkdir(parents=True)
+            p.write_bytes(b"other\n")
+            self.assertEqual(None, c.get("foo"))
+            self.assertEqual(2, c.stats["pass"])
+
+            c.set("foo", b"value\n")
+            self.assertEqual(b"value\n", c.get("foo"))
+
+    def test_negative_cache_set_during_read(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            c = SimpleCache(Path(d))
+            read = c._read
+
+            def read_racing_set(p: str) -> bytes:
+                # Another thread's set() lands after our read missed
+                c._read = read  # type: ignore[method-assign]
+                try:
+                    return read(p)
+                finally:
+                    c.set("foo", b"value\n")
+
+            c._read = read_racing_set  # type: ignore[method-assign]
+            self.assertEqual(None, c.get("foo"))
+            # That stale miss wasn't recorded, so once the value has left the
+            # memory layer it's read from disk again.
+            c._memory.clear()
+            self.assertEqual(b"value\n", c.get("foo"))
+
+    def test_compressed_entries(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            c = SimpleCache(Path(d))
+            c.compress = False
+            c.set("plain", b"value\n")
+            p = c._local_path("junk")
+            p.parent.mkdir(parents=True, exist_ok=True)
+            p.write_bytes(ZSTD_MAGIC + b"not really zstd")
+
+            c2 = SimpleCache(Path(d))
+            # Plain entries are still readable when compression is on
+            self.assertEqual(b"value\n", c2.get("plain"))
+            # Unreadable entries are misses
+            self.assertEqual(None, c2.get("junk"))
+
+            if c2.compress:
+                c2.set("foo", b"value\n" * 100)
+                self.assertEqual(ZSTD_MAGIC, c2._local_path("foo").read_bytes()[:4])
+                c3 = SimpleCache(Path(d))
+                self.assertEqual(b"value\n" * 100, c3.get("foo"))
+
+    def test_memory_layer(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            c = SimpleCache(Path(d))
+            c.set("foo", b"value\n")
+            c._local_path("foo").unlink()
+            # Served from memory
+            self.assertEqual(b"value\n", c.get("foo"))
+            self.assertEqual(1, c.stats["hits"])
+
+            # Disk hits are remembered too
+            c2 = SimpleCache(Path(d))
+            c2.set("bar", b"bar\n")
+            c3 = SimpleCache(Path(d))
+            self.assertEqual(b"bar\n", c3.get("bar"))
+            c3._local_path("bar").unlink()
+            self.assertEqual(b"bar\n", c3.get("bar"))
+
     def test_additional_coverage(self) -> None:
         # cover the appdirs call and ensure it is some kind of path we can
         # manipulate.
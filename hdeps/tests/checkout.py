@@ -0,0 +1,38 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from packaging.requirements import Requirement
+
+from ..checkout import read_checkout_reqs
+
+DEMO_PROJECT = Path(__file__).parent / "demo_project"
+
+
+class CheckoutTest(unittest.TestCase):
+    def test_setup_cfg(self) -> None:
+        source, reqs = read_checkout_reqs(DEMO_PROJECT)
+        self.assertEqual(str(DEMO_PROJECT), source)
+        self.assertEqual(
+            [
+                Requirement("a"),
+                Requirement('b; python_version == "3.6"'),
+                Requirement('c; extra == "foo"'),
+                Requirement('d; python_version == "3.6" and extra == "foo"'),
+            ],
+            reqs,
+        )
+
+    def test_pyproject_preferred(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            pd = Path(d)
+            (pd / "pyproject.toml").write_text(
+                '[project]\nname = "x"\ndependencies = ["y>=1"]\n'
+            )
+            (pd / "setup.cfg").write_text("[options]\ninstall_requires =\n    z\n")
+            self.assertEqual([Requirement("y>=1")], read_checkout_reqs(pd)[1])
+
+    def test_nothing_found(self) -> None:
+        with tempfile.TemporaryDirectory() as d:
+            with self.assertRaises(ValueError):
+                read_checkout_reqs(Path(d))
@@ -1,92 +1,129 @@
+import contextlib
 import logging
 import os
 import re
 import shlex
 import unittest
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import ContextManager, List, Optional, Tuple
 from unittest.mock import patch
 
 from click.testing import CliRunner
-from parameterized import parameterized
 
 from ..cache import NoCache
 from ..cli import main
 
 from ._fake_session import get_fake_session_fixtures
 
-SCENARIOS: List[Tuple[str, Path]] = sorted(
-    # The first item in the tuple is special for parameterized and gets mangled
-    # into the test name.  It needs to be a valid identifier, so we still use
-    # subTest below to get the actual filename printed for copy-pasting.
-    (p.with_suffix("").name, p)
-    for p in Path(__file__).parent.joinpath("scenarios").glob("*.txt")
+# Set to rewrite the expected output in the scenario files, rather than check
+# it.
+UPDATE_SCENARIOS = bool(os.getenv("UPDATE_SCENARIOS"))
+
+# Strips the timestamp from log lines and replaces the line number, in one
+# pass.  The line number is matched either right after a timestamp or at the
+# start of a line without one.
+LOG_LINE_RE = re.compile(
+    r"^(?:\d+ (?=[A-Z][A-Z_0-9]*\s)(?:([A-Z]+\s+[a-z_.]+:)\d+(?= ))?"
+    r"|([A-Z]+\s+[a-z_.]+:)\d+(?= ))",
+    re.M,
 )
 
-LOG_LINE_TIMESTAMP_RE = re.compile(r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3} ", re.M)
-LOG_LINE_NUMERIC_LINE_RE = re.compile(r"^([A-Z]+\s+[a-z_.]+:)\d+(?= )", re.M)
 
+def _clean_log_line(m: re.Match[str]) -> str:
+    prefix = m.group(1) or m.group(2)
+    return prefix + "<n>" if prefix else ""
 
-def load_scenario(path: Path) -> Tuple[Tuple[str, ...], str]:
+
+def _split_command(line: str) -> List[str]:
+    # Most commands are plain words, which don't need shlex's lexer
+    if any(c in line for c in "\"'\\"):
+        return shlex.split(line)
+    return line.split()
+
+
+# (command, expected output, whether to run in an isolated filesystem)
+ScenarioType = Tuple[Tuple[str, ...], str, bool]
+
+
+def load_scenario(path: Path) -> ScenarioType:
     command: Optional[Tuple[str, ...]] = None
-    output: str = ""
+    output: List[str] = []
+    # Only scenarios that write files need a temporary cwd; opt in with a
+    # "# isolated_filesystem: true" header line.
+    isolated_filesystem = False
     state = 0
     with open(path) as f:
         for line in f:
             if state == 0 and line.startswith("#"):
-                pass
+                if line.rstrip() == "# isolated_filesystem: true":
+                    isolated_filesystem = True
             elif state == 0 and line.startswith("$"):
-                parts = shlex.split(line[1:])
+                parts = _split_command(line[1:])
                 assert parts[0] == "hdeps"
                 command = tuple(parts[1:])
                 state = 1
             elif state == 1:
-                output += line
+                output.append(line)
 
     assert state == 1
     assert command is not None
-    return (command, output)
+    return (command, "".join(output), isolated_filesystem)
+
+
+# Each scenario is parsed once here, along with the listing.
+SCENARIOS: List[Tuple[Path, ScenarioType]] = [
+    (p, load_scenario(p))
+    for p in sorted(Path(__file__).parent.joinpath("scenarios").glob("*.txt"))
+]
 
 
 def save_scenario(path: Path, new_output: str) -> None:
     state = 0
-    buf = ""
+    buf: List[str] = []
     with open(path) as f:
         for line in f:
             if state == 0 and line.startswith("#"):
-                buf += line
+                buf.append(line)
             elif state == 0 and line.startswith("$"):
-                buf += line
+                buf.append(line)
                 state = 1
 
     assert state == 1
-    if not buf.endswith("\n"):
-        buf += "\n"
-    path.write_text(buf + new_output)
+    if not buf[-1].endswith("\n"):
+        buf.append("\n")
+    buf.append(new_output)
+    path.write_text("".join(buf))
 
 
 class CliScenariosTest(unittest.TestCase):
     maxDiff = None
 
-    @parameterized.expand(SCENARIOS)  # type:ignore[misc]
     @patch("hdeps.cli.get_retry_session", get_fake_session_fixtures)
     @patch("hdeps.cli.get_cached_retry_session", get_fake_session_fixtures)
     @patch("hdeps.cli.SimpleCache", lambda: NoCache())
-    def test_scenario(self, _unused_name: str, path: Path) -> None:
-        with self.subTest(path):
-            command, output = load_scenario(path)
-
-            runner = CliRunner()
-            with runner.isolated_filesystem():
-                del logging.root.handlers[:]
-                result = runner.invoke(main, command, catch_exceptions=False)
-
-            cleaned_output = LOG_LINE_TIMESTAMP_RE.sub("", result.output)
-            cleaned_output = LOG_LINE_NUMERIC_LINE_RE.sub(
-                lambda m: (m.group(1) + "<n>"), cleaned_output
-            )
-
-            if os.getenv("UPDATE_SCENARIOS"):
+    def test_scenarios(self) -> None:
+        for path, scenario in SCENARIOS:
+            # subTest reports the filename, for copy-pasting
+            with self.subTest(path):
+                self._check_scenario(path, scenario)
+
+    def _check_scenario(self, path: Path, scenario: ScenarioType) -> None:
+        command, output, isolated_filesystem = scenario
+
+        runner = CliRunner()
+        cwd: ContextManager[object] = (
+            runner.isolated_filesystem()
+            if isolated_filesystem
+            else contextlib.nullcontext()
+        )
+        with cwd:
+            del logging.root.handlers[:]
+            result = runner.invoke(main, command, catch_exceptions=False)
+
+        cleaned_output = LOG_LINE_RE.sub(_clean_log_line, result.output)
+
+        if UPDATE_SCENARIOS:
+            if cleaned_output != output:
                 save_scenario(path, cleaned_output)
-            else:
-                self.assertEqual(output, cleaned_output)
+        else:
+            self.assertEqual(output, cleaned_output)
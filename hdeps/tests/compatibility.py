@@ -1,50 +1,144 @@
 import unittest
-from typing import Dict
-from unittest.mock import Mock
+from typing import Optional
+from unittest.mock import Mock, patch
 
+from packaging.requirements import Requirement
+from packaging.specifiers import SpecifierSet
 from packaging.version import Version
 
-from ..compatibility import requires_python_match
+from ..compatibility import (
+    _candidate_window,
+    _compile_specifier,
+    _parse_requires_python,
+    _requires_python_ok,
+    find_best_compatible_version,
+    requires_python_match,
+)
+from ..projects import Project, ProjectVersion
+from ..types import CanonicalName
 
 
 class CompatibilityTest(unittest.TestCase):
     def test_requires_python_match(self) -> None:
         # pretend the env marker says 3.7
         python_version = Version("3.7")
-        cache: Dict[str, bool] = {}
         fake_project = Mock(
             versions={
                 Version("3.6"): Mock(requires_python="zzz"),
                 Version("3.7"): Mock(requires_python=">=3.7"),
                 Version("3.8"): Mock(requires_python=">=3.8"),
+                Version("3.9"): Mock(requires_python=None),
             }
         )
         # This is repeated to test that we read the cached value correctly.
         self.assertFalse(
-            requires_python_match(fake_project, cache, python_version, Version("3.8"))
+            requires_python_match(fake_project, python_version, Version("3.8"))
         )
-        self.assertEqual(False, cache[">=3.8"])
         self.assertFalse(
-            requires_python_match(fake_project, cache, python_version, Version("3.8"))
+            requires_python_match(fake_project, python_version, Version("3.8"))
         )
-        self.assertEqual(False, cache[">=3.8"])
+        self.assertEqual(SpecifierSet(">=3.8"), _parse_requires_python(">=3.8"))
 
         # This too
         self.assertTrue(
-            requires_python_match(fake_project, cache, python_version, Version("3.7"))
+            requires_python_match(fake_project, python_version, Version("3.7"))
         )
-        self.assertEqual(True, cache[">=3.7"])
         self.assertTrue(
-            requires_python_match(fake_project, cache, python_version, Version("3.7"))
+            requires_python_match(fake_project, python_version, Version("3.7"))
         )
-        self.assertEqual(True, cache[">=3.7"])
 
-        # This too
+        # Invalid is treated as matching
+        self.assertTrue(
+            requires_python_match(fake_project, python_version, Version("3.6"))
+        )
         self.assertTrue(
-            requires_python_match(fake_project, cache, python_version, Version("3.6"))
+            requires_python_match(fake_project, python_version, Version("3.6"))
         )
-        self.assertEqual(True, cache["zzz"])
+        self.assertIsNone(_parse_requires_python("zzz"))
+        self.assertTrue(_requires_python_ok("zzz", python_version))
+        self.assertFalse(_requires_python_ok(">=3.8", python_version))
+
         self.assertTrue(
-            requires_python_match(fake_project, cache, python_version, Version("3.6"))
+            requires_python_match(fake_project, python_version, Version("3.9"))
+        )
+
+        # Anything not handled by the simple path is parsed just once, even
+        # for different python versions.
+        _requires_python_ok.cache_clear()
+        _parse_requires_python.cache_clear()
+        with patch("hdeps.compatibility.SpecifierSet", wraps=SpecifierSet) as m:
+            self.assertTrue(_requires_python_ok("~=3.7", python_version))
+            self.assertTrue(_requires_python_ok("~=3.7", python_version))
+            self.assertTrue(_requires_python_ok("~=3.7", Version("3.8")))
+        self.assertEqual(1, m.call_count)
+
+    def test_candidate_window(self) -> None:
+        versions = tuple(
+            Version(v) for v in ("0.9", "1.0", "1.0+local", "1.1", "2.0a1", "2.0")
         )
-        self.assertEqual(True, cache["zzz"])
+        # The window only has to contain every match; it may contain extras.
+        for spec in ("", ">=1.0", ">1.0", "<2.0", "==1.0", "~=1.0", "==1.*", "<=1.1"):
+            specifier = SpecifierSet(spec)
+            self.assertEqual(
+                list(specifier.filter(versions)),
+                list(specifier.filter(_candidate_window(versions, specifier))),
+                spec,
+            )
+        self.assertEqual(
+            versions[1:3], _candidate_window(versions, SpecifierSet(">=1.0,<1.1"))
+        )
+        self.assertEqual((), _candidate_window(versions, SpecifierSet(">2.0")))
+
+    def test_compile_specifier(self) -> None:
+        versions = [
+            Version(v)
+            for v in ("0.9", "1.0", "1.0+local", "1.0+other", "1.0.post1", "2.0a1")
+        ]
+        for spec in (
+            "",
+            ">=1.0",
+            "<=1.0",
+            "==1.0",
+            "==1.0+local",
+            "!=1.0",
+            "!=1.0+local",
+            ">=1.0,!=1.0.post1",
+            ">=2.0a0",
+        ):
+            specifier = SpecifierSet(spec)
+            matcher = _compile_specifier(specifier)
+            assert matcher is not None
+            for v in versions:
+                self.assertEqual(
+                    specifier.contains(v, prereleases=True), matcher(v), (spec, v)
+                )
+        for spec in (">1.0", "<2.0", "~=1.0", "==1.*", "===1.0"):
+            self.assertIsNone(_compile_specifier(SpecifierSet(spec)), spec)
+
+    def test_find_best_compatible_version(self) -> None:
+        project = Project(
+            CanonicalName("p"),
+            {
+                Version(v): ProjectVersion(Version(v), ())
+                for v in ("1.0", "2.0", "2.1.dev1")
+            },
+        )
+        python_version = Version("3.7")
+
+        def best(req: str, chosen: Optional[str], cur: Optional[str]) -> Version:
+            return find_best_compatible_version(
+                project,
+                Requirement(req),
+                python_version,
+                Version(chosen) if chosen else None,
+                lambda name: cur,
+            )
+
+        self.assertEqual(Version("2.0"), best("p", None, None))
+        self.assertEqual(Version("1.0"), best("p", "1.0", None))
+        self.assertEqual(Version("1.0"), best("p", None, "1.0"))
+        self.assertEqual(Version("1.0"), best("p<2", "2.0", None))
+        # A prerelease that was already chosen doesn't win over a final release
+        # unless the specifier allows prereleases.
+        self.assertEqual(Version("2.0"), best("p", "2.1.dev1", None))
+        self.assertEqual(Version("2.1.dev1"), best("p>=2.1.dev0", "2.1.dev1", None))
@@ -0,0 +1,34 @@
+import threading
+import unittest
+from typing import List
+
+from ..executor import PREFETCH_PRIORITY, PriorityThreadPoolExecutor
+
+
+class PriorityThreadPoolExecutorTest(unittest.TestCase):
+    def test_order(self) -> None:
+        pool = PriorityThreadPoolExecutor(max_workers=1)
+        started = threading.Event()
+        release = threading.Event()
+        order: List[str] = []
+
+        def block() -> None:
+            started.set()
+            release.wait()
+
+        blocker = pool.submit(block)
+        started.wait()
+        # Everything else is queued behind the single busy worker
+        a = pool.submit_with_priority(PREFETCH_PRIORITY, order.append, "a")
+        b = pool.submit(order.append, "b")
+        c = pool.submit_with_priority(PREFETCH_PRIORITY, order.append, "c")
+        d = pool.submit(order.append, "d")
+        pool.bump(c)
+        # Running already, so nothing to do
+        pool.bump(blocker)
+        release.set()
+
+        pool.shutdown(wait=True)
+        self.assertEqual(["c", "b", "d", "a"], order)
+        for f in (a, b, c, d):
+            self.assertTrue(f.done())
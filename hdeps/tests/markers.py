@@ -1,8 +1,10 @@
 import unittest
+from dataclasses import asdict
 
 from packaging.requirements import Requirement
+from packaging.version import Version
 
-from ..markers import EnvironmentMarkers
+from ..markers import EnvironmentMarkers, MAX_MATCH_CACHE_ENTRIES
 
 
 class EnvironmentMarkersTest(unittest.TestCase):
@@ -39,3 +41,34 @@ class EnvironmentMarkersTest(unittest.TestCase):
         self.assertFalse(e.match(req.marker, []))
         self.assertFalse(e.match(req.marker, ["x"]))
         self.assertFalse(e.match(req.marker, ["x", "y"]))
+
+    def test_parsed_python_full_version(self) -> None:
+        e = EnvironmentMarkers.from_args("3.7", None)
+        self.assertEqual(Version("3.7.0"), e.parsed_python_full_version)
+        self.assertIs(e.parsed_python_full_version, e.parsed_python_full_version)
+        self.assertIsNone(EnvironmentMarkers().parsed_python_full_version)
+
+    def test_env_covers_all_fields(self) -> None:
+        e = EnvironmentMarkers.from_args("3.7", "win32")
+        self.assertEqual(asdict(e), e._env)
+
+    def test_match_memoized(self) -> None:
+        req = Requirement("foo ; extra == 'x'")
+        e = EnvironmentMarkers.from_args("3.7", None)
+        self.assertTrue(e.match(req.marker, ["x"]))
+        self.assertTrue(e.match(req.marker, ["x"]))
+        self.assertFalse(e.match(req.marker))
+        self.assertEqual(2, len(e._match_cache))
+        self.assertTrue(e.match(None))
+
+    def test_match_cache_bounded(self) -> None:
+        e = EnvironmentMarkers.from_args("3.7", None)
+        reqs = [
+            Requirement(f"foo ; extra == 'x{i}'")
+            for i in range(MAX_MATCH_CACHE_ENTRIES + 1)
+        ]
+        for req in reqs:
+            self.assertFalse(e.match(req.marker))
+        self.assertEqual(MAX_MATCH_CACHE_ENTRIES, len(e._match_cache))
+        # The oldest one was dropped
+        self.assertNotIn((id(reqs[0].marker), ()), e._match_cache)
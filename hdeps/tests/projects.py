@@ -1,28 +1,189 @@
+import hashlib
+import io
+import json
 import tempfile
 import unittest
+from functools import partial
 from pathlib import Path
+from tarfile import TarFile, TarInfo
+from typing import Any, Dict
+from unittest.mock import Mock
+from urllib.parse import urlsplit
+from zipfile import ZipFile
+
+import metadata_please
 
 from packaging.requirements import Requirement
 from packaging.version import Version
 
-from pypi_simple import DistributionPackage, PyPISimple
+from pypi_simple import (
+    DigestMismatchError,
+    DistributionPackage,
+    ProjectPage,
+    PyPISimple,
+)
+from requests.exceptions import ConnectionError, HTTPError
+from seekablehttpfile.core import get_range_requests
 
 from ..cache import SimpleCache
-from ..projects import ProjectVersion
+from ..projects import (
+    _metadata_from_pypi_json,
+    _metadata_from_tar_sdist_url,
+    _prefetch_wheel_metadata,
+    _PrefetchingHttpFile,
+    convert_sdist_requires,
+    filter_requires_txt_names,
+    iter_metadata_headers,
+    Project,
+    ProjectVersion,
+)
 
 from ._fake_session import FakeSession
 
 DIST_ROOT = Path(__file__).parent.joinpath("demo_project/dist")
 
-EXPECTED_REQS = [
-    Requirement("a"),
-    Requirement('b; python_version == "3.6"'),
-    Requirement('c; extra == "foo"'),
-    Requirement('d; python_version == "3.6" and extra == "foo"'),
-]
+# Compared as strings, which is cheaper than Requirement equality and gives a
+# readable diff.
+EXPECTED_REQS = tuple(
+    str(Requirement(r))
+    for r in (
+        "a",
+        'b; python_version == "3.6"',
+        'c; extra == "foo"',
+        'd; python_version == "3.6" and extra == "foo"',
+    )
+)
+
+
+def dp(filename: str, package_type: str, requires_python: str) -> Any:
+    return DistributionPackage(
+        project="demo_project",
+        version="0.0.0",
+        digests={},
+        requires_python=requires_python,
+        has_sig=False,
+        filename=filename,
+        url=filename,
+        package_type=package_type,
+    )
 
 
 class ProjectMetadataTest(unittest.TestCase):
+    # Sessions are stateless apart from the fixture cache, so they're shared.
+    # Each test gets its own cache (for the stats), under one directory.
+    session: FakeSession
+    pypi_simple: PyPISimple
+    cache_dir: tempfile.TemporaryDirectory[str]
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.session = FakeSession(DIST_ROOT)
+        cls.pypi_simple = PyPISimple(session=cls.session)  # type: ignore
+        cls.cache_dir = tempfile.TemporaryDirectory()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.cache_dir.cleanup()
+
+    def new_cache(self) -> SimpleCache:
+        return SimpleCache(Path(self.cache_dir.name), suffix=self._testMethodName)
+
+    def test_iter_metadata_headers(self) -> None:
+        md = (
+            "Metadata-Version: 2.1\r\n"
+            "Name: x\n"
+            "Requires-Dist: a\n"
+            "  ; python_version < '3'\n"
+            "REQUIRES-DIST:   b>=1\n"
+            "\n"
+            "Requires-Dist: this is the body\n"
+        )
+        self.assertEqual(
+            [
+                ("metadata-version", "2.1"),
+                ("name", "x"),
+                ("requires-dist", "a  ; python_version < '3'"),
+                ("requires-dist", "b>=1"),
+            ],
+            list(iter_metadata_headers(md)),
+        )
+
+    def test_filter_requires_txt_names(self) -> None:
+        self.assertEqual(
+            ["a/requires.txt", "a/b.egg-info/requires.txt"],
+            filter_requires_txt_names(
+                [
+                    "a/requires.txt",
+                    "a/b.egg-info/requires.txt",
+                    "a/b/c.egg-info/requires.txt",
+                    "requires.txt",
+                    "a/b.egg-info/requires.txt.orig",
+                    "a/b.egg-info/dev-requires.txt",
+                ]
+            ),
+        )
+
+    def test_convert_sdist_requires(self) -> None:
+        self.assertEqual(
+            (
+                [
+                    "a",
+                    "b; extra == 'foo'",
+                    "c; (python_version < '3') and extra == 'bar'",
+                    "d; python_version < '3'",
+                ],
+                {"bar"},
+            ),
+            convert_sdist_requires(
+                " a \n\n[foo]\nb\n[bar:python_version < '3']\nc\r\n"
+                "[:python_version < '3']\n  d\n"
+            ),
+        )
+
+    def test_derived_attributes(self) -> None:
+        pv = ProjectVersion(
+            Version("0.0.0"),
+            (
+                dp("demo_project-0.0.0.tar.gz", "sdist", ""),
+                dp("demo_project-0.0.0-py3-none-any.whl", "wheel", ">=3.7"),
+            ),
+        )
+        self.assertEqual(">=3.7", pv.requires_python)
+        self.assertTrue(pv.has_sdist)
+        self.assertTrue(pv.has_wheel)
+        self.assertFalse(pv.yanked)
+
+        pv = ProjectVersion(
+            Version("0.0.0"), (dp("demo_project-0.0.0.tar.gz", "sdist", ""),)
+        )
+        # Empty is normalized to None
+        self.assertIsNone(pv.requires_python)
+        self.assertFalse(pv.has_wheel)
+
+    def test_project_versions_interned(self) -> None:
+        def page(*packages: DistributionPackage) -> ProjectPage:
+            return ProjectPage(
+                project="Demo_Project",
+                packages=list(packages),
+                repository_version=None,
+                last_serial=None,
+                tracks=[],
+                alternate_locations=[],
+            )
+
+        sdist = dp("demo_project-0.0.0.tar.gz", "sdist", "")
+        wheel = dp("demo_project-0.0.0-py3-none-any.whl", "wheel", "")
+        p1 = Project.from_pypi_simple_project_page(page(sdist))
+        p2 = Project.from_pypi_simple_project_page(page(sdist))
+        v = Version("0.0.0")
+        self.assertIs(p1.versions[v], p2.versions[v])
+        self.assertIs(p1.versions[v], p1.latest_version)
+
+        # Different files, different object
+        p3 = Project.from_pypi_simple_project_page(page(sdist, wheel))
+        self.assertIsNot(p1.versions[v], p3.versions[v])
+        self.assertTrue(p3.versions[v].has_wheel)
+
     def test_wheel(self) -> None:
         pv = ProjectVersion(
             Version("0.0.0"),
@@ -39,29 +200,66 @@ class ProjectMetadataTest(unittest.TestCase):
                 ),
             ),
         )
-        with tempfile.TemporaryDirectory() as d:
-            cache = SimpleCache(Path(d))
-            md = pv.get_deps(
-                ps=None,  # type: ignore
-                session=FakeSession(DIST_ROOT),  # type: ignore
-                extracted_metadata_cache=cache,
-            )
-            self.assertEqual(EXPECTED_REQS, md.reqs)
-            self.assertEqual(["foo"], md.extras)
-            self.assertEqual(1, cache.stats["pass"])
-            self.assertEqual(1, cache.stats["sets"])
-
-            # Now load from cache
-            md = pv.get_deps(
-                ps=None,  # type: ignore
-                session=FakeSession(DIST_ROOT),  # type: ignore
-                extracted_metadata_cache=cache,
-            )
-            self.assertEqual(EXPECTED_REQS, md.reqs)
-            self.assertEqual(["foo"], md.extras)
-            self.assertEqual(1, cache.stats["hits"])  # inc just this
-            self.assertEqual(1, cache.stats["pass"])
-            self.assertEqual(1, cache.stats["sets"])
+        cache = self.new_cache()
+        md = pv.get_deps(
+            ps=None,  # type: ignore
+            session=self.session,  # type: ignore
+            extracted_metadata_cache=cache,
+        )
+        self.assertEqual(EXPECTED_REQS, tuple(str(r) for r in md.reqs))
+        self.assertEqual(["foo"], md.extras)
+        self.assertEqual(1, cache.stats["pass"])
+        self.assertEqual(1, cache.stats["sets"])
+
+        # The same ProjectVersion keeps what it parsed
+        md2 = pv.get_deps(
+            ps=None,  # type: ignore
+            session=None,  # type: ignore
+            extracted_metadata_cache=cache,
+        )
+        self.assertEqual(md.reqs, md2.reqs)
+        self.assertEqual(0, cache.stats["hits"])
+
+        # Now load from cache, with a ProjectVersion that hasn't parsed it yet
+        pv = ProjectVersion(pv.version, pv.packages)
+        md = pv.get_deps(
+            ps=None,  # type: ignore
+            session=self.session,  # type: ignore
+            extracted_metadata_cache=cache,
+        )
+        self.assertEqual(EXPECTED_REQS, tuple(str(r) for r in md.reqs))
+        self.assertEqual(["foo"], md.extras)
+        self.assertEqual(1, cache.stats["hits"])  # inc just this
+        self.assertEqual(1, cache.stats["pass"])
+        self.assertEqual(1, cache.stats["sets"])
+
+    def test_prefetch_wheel_metadata(self) -> None:
+        name = "demo_project-0.0.0-py3-none-any.whl"
+        f = _PrefetchingHttpFile(
+            name,
+            get_range=partial(get_range_requests, session=self.session),
+            precache=100,
+        )
+        zf = ZipFile(f)  # type: ignore[arg-type,call-overload,unused-ignore]
+        requests_before = f.stats["num_requests"]
+        _prefetch_wheel_metadata(f, zf)
+        self.assertEqual(requests_before + 1, f.stats["num_requests"])
+        md = zf.read("demo_project-0.0.0.dist-info/METADATA")
+        self.assertIn(b"Requires-Dist: a", md)
+        # Served entirely from the prefetched bytes
+        self.assertEqual(requests_before + 1, f.stats["num_requests"])
+
+    def test_prefetch_wheel_metadata_already_cached(self) -> None:
+        # METADATA is within the (default-sized) tail that's always fetched
+        name = "demo_project-0.0.0-py3-none-any.whl"
+        f = _PrefetchingHttpFile(
+            name, get_range=partial(get_range_requests, session=self.session)
+        )
+        zf = ZipFile(f)  # type: ignore[arg-type,call-overload,unused-ignore]
+        requests_before = f.stats["num_requests"]
+        _prefetch_wheel_metadata(f, zf)
+        zf.read("demo_project-0.0.0.dist-info/METADATA")
+        self.assertEqual(requests_before, f.stats["num_requests"])
 
     def test_zip_sdist(self) -> None:
         pv = ProjectVersion(
@@ -79,29 +277,29 @@ class ProjectMetadataTest(unittest.TestCase):
                 ),
             ),
         )
-        with tempfile.TemporaryDirectory() as d:
-            cache = SimpleCache(Path(d))
-            md = pv.get_deps(
-                ps=None,  # type: ignore
-                session=FakeSession(DIST_ROOT),  # type: ignore
-                extracted_metadata_cache=cache,
-            )
-            self.assertEqual(EXPECTED_REQS, md.reqs)
-            self.assertEqual(["foo"], md.extras)
-            self.assertEqual(1, cache.stats["pass"])
-            self.assertEqual(1, cache.stats["sets"])
-
-            # Now load from cache
-            md = pv.get_deps(
-                ps=None,  # type: ignore
-                session=FakeSession(DIST_ROOT),  # type: ignore
-                extracted_metadata_cache=cache,
-            )
-            self.assertEqual(EXPECTED_REQS, md.reqs)
-            self.assertEqual(["foo"], md.extras)
-            self.assertEqual(1, cache.stats["hits"])  # inc just this
-            self.assertEqual(1, cache.stats["pass"])
-            self.assertEqual(1, cache.stats["sets"])
+        cache = self.new_cache()
+        md = pv.get_deps(
+            ps=None,  # type: ignore
+            session=self.session,  # type: ignore
+            extracted_metadata_cache=cache,
+        )
+        self.assertEqual(EXPECTED_REQS, tuple(str(r) for r in md.reqs))
+        self.assertEqual(["foo"], md.extras)
+        self.assertEqual(1, cache.stats["pass"])
+        self.assertEqual(1, cache.stats["sets"])
+
+        # Now load from cache, with a ProjectVersion that hasn't parsed it yet
+        pv = ProjectVersion(pv.version, pv.packages)
+        md = pv.get_deps(
+            ps=None,  # type: ignore
+            session=self.session,  # type: ignore
+            extracted_metadata_cache=cache,
+        )
+        self.assertEqual(EXPECTED_REQS, tuple(str(r) for r in md.reqs))
+        self.assertEqual(["foo"], md.extras)
+        self.assertEqual(1, cache.stats["hits"])  # inc just this
+        self.assertEqual(1, cache.stats["pass"])
+        self.assertEqual(1, cache.stats["sets"])
 
     def test_tar_gz_sdist(self) -> None:
         pv = ProjectVersion(
@@ -119,27 +317,135 @@ class ProjectMetadataTest(unittest.TestCase):
                 ),
             ),
         )
+        cache = self.new_cache()
+        md = pv.get_deps(
+            ps=self.pypi_simple,
+            session=self.session,  # type: ignore
+            extracted_metadata_cache=cache,
+        )
+        self.assertEqual(EXPECTED_REQS, tuple(str(r) for r in md.reqs))
+        self.assertEqual(["foo"], md.extras)
+        self.assertEqual(1, cache.stats["pass"])
+        self.assertEqual(1, cache.stats["sets"])
+
+        # Now load from cache, with a ProjectVersion that hasn't parsed it yet
+        pv = ProjectVersion(pv.version, pv.packages)
+        md = pv.get_deps(
+            ps=self.pypi_simple,
+            session=self.session,  # type: ignore
+            extracted_metadata_cache=cache,
+        )
+        self.assertEqual(EXPECTED_REQS, tuple(str(r) for r in md.reqs))
+        self.assertEqual(["foo"], md.extras)
+
+        self.assertEqual(1, cache.stats["hits"])  # inc just this
+        self.assertEqual(1, cache.stats["pass"])
+        self.assertEqual(1, cache.stats["sets"])
+
+    def test_tar_gz_sdist_streamed(self) -> None:
+        filename = "demo_project-0.0.0.tar.gz"
+        sha256 = hashlib.sha256(DIST_ROOT.joinpath(filename).read_bytes()).hexdigest()
+        session: Any = self.session
+        pkg = dp(filename, "sdist", "")
+
+        pkg.digests = {"sha256": sha256}
+        with TarFile.open(DIST_ROOT / filename) as tf:
+            expected = metadata_please.from_tar_sdist(tf)
+        self.assertEqual(expected, _metadata_from_tar_sdist_url(session, pkg))
+
+        pkg.digests = {"sha256": "0" * 64}
+        with self.assertRaises(DigestMismatchError):
+            _metadata_from_tar_sdist_url(session, pkg)
+
+    def test_tar_gz_sdist_streamed_extras(self) -> None:
         with tempfile.TemporaryDirectory() as d:
-            cache = SimpleCache(Path(d))
-            md = pv.get_deps(
-                ps=PyPISimple(session=FakeSession(DIST_ROOT)),  # type: ignore
-                session=None,  # type: ignore
-                extracted_metadata_cache=cache,
-            )
-            self.assertEqual(EXPECTED_REQS, md.reqs)
-            self.assertEqual(["foo"], md.extras)
-            self.assertEqual(1, cache.stats["pass"])
-            self.assertEqual(1, cache.stats["sets"])
-
-            # Now load from cache
-            md = pv.get_deps(
-                ps=PyPISimple(session=FakeSession(DIST_ROOT)),  # type: ignore
-                session=None,  # type: ignore
-                extracted_metadata_cache=cache,
+            filename = "x-1.0.tar.gz"
+            requires = b"a\n[foo]\nb\n[bar:python_version < '3']\nc\n"
+            with TarFile.open(Path(d, filename), "w:gz") as tf:
+                ti = TarInfo("x-1.0/x.egg-info/requires.txt")
+                ti.size = len(requires)
+                tf.addfile(ti, io.BytesIO(requires))
+            with TarFile.open(Path(d, filename)) as tf:
+                expected = metadata_please.from_tar_sdist(tf)
+            self.assertIn(b"Provides-Extra: foo\n", expected)
+
+            session: Any = FakeSession(Path(d))
+            self.assertEqual(
+                expected,
+                _metadata_from_tar_sdist_url(session, dp(filename, "sdist", "")),
             )
-            self.assertEqual(EXPECTED_REQS, md.reqs)
-            self.assertEqual(["foo"], md.extras)
 
-            self.assertEqual(1, cache.stats["hits"])  # inc just this
-            self.assertEqual(1, cache.stats["pass"])
-            self.assertEqual(1, cache.stats["sets"])
+    def test_pypi_json(self) -> None:
+        filename = "demo_project-0.0.0.tar.gz"
+        doc: Dict[str, Any] = {
+            "info": {
+                "requires_dist": ["a", "c; extra == 'foo'"],
+                "provides_extra": ["foo"],
+            },
+            "urls": [{"filename": filename}],
+        }
+        session = Mock()
+        session.get.return_value.content = json.dumps(doc).encode()
+        pkg = dp(filename, "sdist", "")
+        cache = self.new_cache()
+
+        # Only for files on PyPI
+        self.assertIsNone(_metadata_from_pypi_json(pkg, session, cache))
+        session.get.assert_not_called()
+
+        pkg.url = "https://files.pythonhosted.org/packages/" + filename
+        md = "Requires-Dist: a\nRequires-Dist: c; extra == 'foo'\nProvides-Extra: foo\n"
+        self.assertEqual(md, _metadata_from_pypi_json(pkg, session, cache))
+        session.get.assert_called_once_with(
+            "https://pypi.org/pypi/demo_project/0.0.0/json"
+        )
+        # Cached
+        self.assertEqual(md, _metadata_from_pypi_json(pkg, session, cache))
+        self.assertEqual(1, session.get.call_count)
+
+        # Everything else falls back to extraction
+        pkg.url += "?uncached"
+        for info, files in (
+            # Unknown deps
+            ({"requires_dist": None}, [{"filename": filename}]),
+            # Release-level deps that might belong to another file
+            (doc["info"], [{"filename": filename}, {"filename": "other.whl"}]),
+            (doc["info"], [{"filename": "other.whl"}]),
+        ):
+            with self.subTest(files=files):
+                session.get.return_value.content = json.dumps(
+                    {"info": info, "urls": files}
+                ).encode()
+                self.assertIsNone(_metadata_from_pypi_json(pkg, session, cache))
+
+        session.get.return_value.content = b"not json"
+        self.assertIsNone(_metadata_from_pypi_json(pkg, session, cache))
+
+        session.get.return_value.raise_for_status.side_effect = HTTPError("500")
+        self.assertIsNone(_metadata_from_pypi_json(pkg, session, cache))
+
+        session.get.side_effect = ConnectionError()
+        self.assertIsNone(_metadata_from_pypi_json(pkg, session, cache))
+
+    def test_pypi_json_multiple_files(self) -> None:
+        # The JSON API isn't asked at all when the release has other files
+        pv = ProjectVersion(
+            Version("0.0.0"),
+            (
+                dp("demo_project-0.0.0.tar.gz", "sdist", ""),
+                dp("demo_project-0.0.0-py3-none-any.whl", "wheel", ""),
+            ),
+        )
+        for pkg in pv.packages:
+            pkg.url = "https://files.pythonhosted.org/packages/" + pkg.filename
+        session = Mock(wraps=self.session)
+        md = pv.get_deps(
+            ps=None,  # type: ignore
+            session=session,
+            extracted_metadata_cache=self.new_cache(),
+        )
+        self.assertEqual(EXPECTED_REQS, tuple(str(r) for r in md.reqs))
+        self.assertNotIn(
+            "pypi.org",
+            {urlsplit(c.args[0]).hostname for c in session.get.call_args_list},
+        )
@@ -1,16 +1,23 @@
+import io
 import os
 import tempfile
 import unittest
+from glob import glob
 from pathlib import Path
 
-from ..requirements import iter_glob_all_requirement_names, iter_requirement_names
+from ..requirements import (
+    _glob,
+    iter_glob_all_requirement_names,
+    iter_requirement_names,
+)
 
 
 class RequirementsTest(unittest.TestCase):
+    glob_dir: tempfile.TemporaryDirectory[str]
+
     def test_iter_requirement_names(self) -> None:
-        with tempfile.NamedTemporaryFile(delete=False) as f:
-            f.write(
-                b"""\
+        f = io.BytesIO(
+            b"""\
 --index-url foo
 a
 
@@ -18,32 +25,45 @@ a
 B # inline comment
 c==2
 """
-            )
-            f.close()
-            self.assertEqual(
-                ["a", "b", "c"], list(iter_requirement_names(Path(f.name)))
-            )
+        )
+        self.assertEqual(["a", "b", "c"], list(iter_requirement_names(f)))
+
+    # The tree for the glob test is built once for the class
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.glob_dir = tempfile.TemporaryDirectory()
+        pd = Path(cls.glob_dir.name)
+        for name, contents in (
+            ("requirements.txt", "x\n"),
+            (".hidden.txt", "y\n"),
+            ("a/requirements.txt", "a==1\n"),
+            ("test/requirements.txt", "b==1\n"),
+            ("tbat/requirements.txt", "c==1\n"),
+        ):
+            (pd / name).parent.mkdir(exist_ok=True)
+            (pd / name).write_text(contents)
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.glob_dir.cleanup()
 
     def test_iter_glob_all_requirement_names(self) -> None:
-        with tempfile.TemporaryDirectory() as d:
-            pd = Path(d)
-
-            (pd / "a").mkdir()
-            (pd / "test").mkdir()
-            (pd / "tbat").mkdir()
-
-            (pd / "requirements.txt").write_text("x\n")
-            (pd / "a" / "requirements.txt").write_text("a==1\n")
-            (pd / "test" / "requirements.txt").write_text("b==1\n")
-            (pd / "tbat" / "requirements.txt").write_text("c==1\n")
-            prev = os.getcwd()
-            try:
-                os.chdir(d)
-                self.assertEqual(
-                    ["b", "c", "x"],
-                    sorted(
-                        iter_glob_all_requirement_names("*.txt,t*/requirements.txt,")
-                    ),
-                )
-            finally:
-                os.chdir(prev)
+        prev = os.getcwd()
+        try:
+            os.chdir(self.glob_dir.name)
+            for pattern in (
+                "*.txt",
+                "*",
+                "a/*.txt",
+                "a/*",
+                "missing/*.txt",
+                "requirements.txt/*",
+                "t*/requirements.txt",
+            ):
+                self.assertEqual(sorted(glob(pattern)), sorted(_glob(pattern)))
+            self.assertEqual(
+                ["b", "c", "x"],
+                sorted(iter_glob_all_requirement_names("*.txt,t*/requirements.txt,")),
+            )
+        finally:
+            os.chdir(prev)
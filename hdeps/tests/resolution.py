@@ -1,10 +1,7 @@
 import io
 import unittest
-from pathlib import Path
 from unittest.mock import patch
 
-from click.testing import CliRunner
-
 from packaging.requirements import Requirement
 from pypi_simple import PyPISimple
 
@@ -12,7 +9,7 @@ from ..cache import NoCache
 from ..markers import EnvironmentMarkers
 from ..resolution import Walker
 
-from ._fake_session import FakeSession
+from ._fake_session import FakeSession, FIXTURES
 
 
 class ResolutionTest(unittest.TestCase):
@@ -20,20 +17,18 @@ class ResolutionTest(unittest.TestCase):
     # cli_scenarios tests but without invoking through click, just to ensure the api
     # remains stable.
     def test_simple_integration(self) -> None:
-        session = FakeSession(Path(__file__).parent / "fixtures")
+        session = FakeSession(FIXTURES)
         pypi_simple = PyPISimple(session=session)  # type: ignore[arg-type]
         env_markers = EnvironmentMarkers.from_args("3.7.5", None)
-        runner = CliRunner()
-        with runner.isolated_filesystem():
-            walker = Walker(
-                1,
-                env_markers,
-                pypi_simple,
-                session,  # type: ignore[arg-type]
-                extracted_metadata_cache=NoCache(),
-            )
-            walker.feed(Requirement("batman==1"))
-            walker.drain()
+        walker = Walker(
+            1,
+            env_markers,
+            pypi_simple,
+            session,  # type: ignore[arg-type]
+            extracted_metadata_cache=NoCache(),
+        )
+        walker.feed(Requirement("batman==1"))
+        walker.drain()
 
         new_stdout = io.StringIO()
         with patch("sys.stdout", new_stdout):
@@ -60,20 +55,18 @@ batman (==1.0) via ==1
         )
 
     def test_reuse_integration(self) -> None:
-        session = FakeSession(Path(__file__).parent / "fixtures")
+        session = FakeSession(FIXTURES)
         pypi_simple = PyPISimple(session=session)  # type: ignore[arg-type]
         env_markers = EnvironmentMarkers.from_args("3.7.5", None)
-        runner = CliRunner()
-        with runner.isolated_filesystem():
-            walker = Walker(
-                1,
-                env_markers,
-                pypi_simple,
-                session,  # type: ignore[arg-type]
-                extracted_metadata_cache=NoCache(),
-            )
-            walker.feed(Requirement("batman==1"))
-            walker.drain()
+        walker = Walker(
+            1,
+            env_markers,
+            pypi_simple,
+            session,  # type: ignore[arg-type]
+            extracted_metadata_cache=NoCache(),
+        )
+        walker.feed(Requirement("batman==1"))
+        walker.drain()
 
         new_stdout = io.StringIO()
         with patch("sys.stdout", new_stdout):
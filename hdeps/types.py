@@ -1,35 +1,80 @@
 from __future__ import annotations
 
+import sys
 from dataclasses import dataclass, field
+from functools import lru_cache
 from typing import Callable, List, NewType, Optional, Tuple
 
 from packaging.markers import Marker
 from packaging.specifiers import SpecifierSet
+from packaging.utils import canonicalize_name
 from packaging.version import Version
 
 CanonicalName = NewType("CanonicalName", str)
+
+
+@lru_cache(maxsize=8192)
+def canonical_name(name: str) -> CanonicalName:
+    """
+    Canonicalizes and interns `name`, so that the many dict lookups keyed on it
+    can usually short-circuit on identity.  The same handful of names is seen
+    over and over during a walk, so this is memoized too.
+    """
+    return CanonicalName(sys.intern(canonicalize_name(name)))
+
+
 VersionCallback = Callable[[CanonicalName], Optional[str]]
 
-ChoiceKeyType = Tuple[CanonicalName, Version, Tuple[str, ...]]
+ChoiceKeyType = Tuple[CanonicalName, Version, Tuple[CanonicalName, ...]]
 
 
-@dataclass
+# Slotted since drain() makes one of each per requirement it processes.  The
+# generated reprs would recurse through the whole subtree (Choice.deps ->
+# Edge.target -> ...), so these just describe the node itself.
+#
+# A Choice is identified by its key(), so it compares and hashes by that (the
+# hash is computed once, which spares re-hashing the Version).
+@dataclass(slots=True, repr=False, eq=False)
 class Choice:
-    project: CanonicalName = field(repr=True)
-    version: Version = field(repr=True)
-    # TODO extras should be normalized, thus CanonicalName
-    extras: Tuple[str, ...] = field(default_factory=tuple)
+    project: CanonicalName
+    version: Version
+    # Normalized (and interned) in __post_init__
+    extras: Tuple[CanonicalName, ...] = field(default_factory=tuple)
     deps: List[Edge] = field(default_factory=list)
     has_sdist: bool = False
     has_wheel: bool = False
+    # The identifying fields never change after construction, so the key is
+    # built once.
+    _key: ChoiceKeyType = field(init=False)
+    _hash: int = field(init=False)
+
+    def __post_init__(self) -> None:
+        if self.extras:
+            self.extras = tuple(canonical_name(e) for e in self.extras)
+        self._key = (self.project, self.version, self.extras)
+        self._hash = hash(self._key)
 
     def key(self) -> ChoiceKeyType:
-        return (self.project, self.version, self.extras)
+        return self._key
 
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Choice):
+            return NotImplemented
+        return self._hash == other._hash and self._key == other._key
 
-@dataclass
+    def __hash__(self) -> int:
+        return self._hash
+
+    def __repr__(self) -> str:
+        return f"Choice({self.project!r}, {self.version!r}, extras={self.extras!r})"
+
+
+@dataclass(slots=True, repr=False)
 class Edge:
-    target: Choice = field(repr=True)
+    target: Choice
     specifier: Optional[SpecifierSet]
     markers: Optional[Marker]
     note: Optional[str]
+
+    def __repr__(self) -> str:
+        return f"Edge(-> {self.target.project} {self.specifier}, note={self.note!r})"